@@ -0,0 +1,78 @@
+import logging
+from typing import List, Tuple
+
+import numpy as np
+from twisted.internet.defer import Deferred
+
+logger = logging.getLogger(__name__)
+
+
+class BatchInferenceService:
+    """Collects rows to classify from many spider callbacks and runs them through the model in batches.
+
+    `predict()` returns a Deferred fired with predicted labels for the given rows. Rows are sent to
+    the model when `max_batch_size` rows are pending or `max_delay` seconds after the first one came.
+    Inference runs in a thread so the reactor keeps downloading meanwhile, one batch at a time:
+    rows arriving while the model is busy are collected into the next batch.
+    """
+    def __init__(self, clf, max_batch_size: int = 32, max_delay: float = 0.1, stats=None, stats_prefix: str = ''):
+        self.clf = clf
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.stats = stats
+        self.stats_prefix = stats_prefix
+        self.pending: List[Tuple[list, Deferred]] = []
+        self.pending_rows = 0
+        self.running = False
+        self._delayed_flush = None
+
+    def predict_proba(self, rows: list) -> Deferred:
+        d = Deferred()
+        if len(rows) == 0:
+            d.callback(np.zeros((0, len(self.clf.label_class_weights))))
+            return d
+        self.pending.append((rows, d))
+        self.pending_rows += len(rows)
+        if self.pending_rows >= self.max_batch_size:
+            self.flush()
+        elif self._delayed_flush is None:
+            from twisted.internet import reactor
+            self._delayed_flush = reactor.callLater(self.max_delay, self.flush)
+        return d
+
+    def predict(self, rows: list) -> Deferred:
+        return self.predict_proba(rows).addCallback(lambda proba: proba.argmax(-1))
+
+    def flush(self):
+        if self._delayed_flush is not None:
+            if self._delayed_flush.active():
+                self._delayed_flush.cancel()
+            self._delayed_flush = None
+        if self.running or len(self.pending) == 0:
+            return
+
+        from twisted.internet import threads
+        batch, self.pending, self.pending_rows = self.pending, [], 0
+        rows = [row for batch_rows, _ in batch for row in batch_rows]
+        self.running = True
+        if self.stats is not None:
+            self.stats.inc_value(self.stats_prefix + 'inference_batches')
+            self.stats.inc_value(self.stats_prefix + 'inference_rows', len(rows))
+        logger.debug("Running inference batch of %s rows from %s requests", len(rows), len(batch))
+        d = threads.deferToThread(self.clf.predict_proba_batch, rows, self.max_batch_size)
+        d.addCallbacks(self._done, self._failed, callbackArgs=(batch,), errbackArgs=(batch,))
+
+    def _done(self, proba, batch):
+        self.running = False
+        start = 0
+        for rows, d in batch:
+            d.callback(proba[start:start + len(rows)])
+            start += len(rows)
+        self.flush()
+
+    def _failed(self, failure, batch):
+        self.running = False
+        logger.error("Inference batch failed: %s", failure.getErrorMessage())
+        for _, d in batch:
+            d.errback(failure)
+        self.flush()
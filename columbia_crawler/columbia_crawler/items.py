@@ -7,6 +7,7 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
 import logging
 import random
 import re
@@ -309,6 +310,8 @@ class CulpaInstructor(scrapy.Item):
     name = scrapy.Field()
     link = scrapy.Field()
     reviews = scrapy.Field()
+    # reviews contain only reviews newer than known ones and need to be merged with stored reviews
+    reviews_incremental = scrapy.Field()
     reviews_count = scrapy.Field()
     nugget = scrapy.Field()
 
@@ -324,6 +327,10 @@ class CulpaInstructor(scrapy.Item):
         disagree_count = scrapy.Field()
         funny_count = scrapy.Field()
 
+        # stored with every review, increase when parsing changes: profiles with reviews of older versions
+        # (or without version, parsed before course links were scoped to the review) are parsed again in full
+        PARSER_VERSION = 2
+
         def to_dict(self) -> dict:
             return {
                 'course_codes': self['course_codes'],
@@ -333,12 +340,32 @@ class CulpaInstructor(scrapy.Item):
                 'agree_count':  self['agree_count'],
                 'disagree_count':   self['disagree_count'],
                 'funny_count':      self['funny_count'],
+                'parser_version':   CulpaInstructor.Review.PARSER_VERSION,
             }
 
+        @staticmethod
+        def fingerprint(review: dict) -> str:
+            """Identifies stored review (see `to_dict`) by its date and text
+
+            >>> CulpaInstructor.Review.fingerprint({'publish_date': '2019-03-03', 'text': 'Great'})
+            '6415885b77d23ac4b17118759da2bbc8a19f487c'
+            """
+            return hashlib.sha1((review['publish_date'] + '\n' + review['text']).encode('utf-8')).hexdigest()
+
+        @staticmethod
+        def is_current(review: dict) -> bool:
+            """Whether stored review was parsed by the current parser
+
+            >>> CulpaInstructor.Review.is_current({'publish_date': '2019-03-03', 'text': 'Great'})
+            False
+            """
+            return review.get('parser_version') == CulpaInstructor.Review.PARSER_VERSION
+
     @staticmethod
     def get_test():
         test_item = get_test_item(CulpaInstructor)
         test_item['reviews_count'] = random.randint(1, 999)
+        test_item['reviews_incremental'] = False
         test_item['nugget'] = random.choice([None, CulpaInstructor.NUGGET_GOLD, CulpaInstructor.NUGGET_SILVER])
         return test_item
 
@@ -367,6 +394,8 @@ class WikipediaInstructorPotentialArticle(scrapy.Item):
     department = scrapy.Field()
     wikipedia_title = scrapy.Field()
     wikipedia_raw_page = scrapy.Field()
+    # page text is the intro section only (multi-title queries), the article model is trained on full pages
+    intro_only = scrapy.Field()
 
     def __repr__(self):
         return repr({name: self[name] for name in self.fields.keys()
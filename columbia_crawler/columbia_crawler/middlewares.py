@@ -5,7 +5,12 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import json
+import urllib
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import TextResponse
 
 
 class ColumbiaCrawlerSpiderMiddleware(object):
@@ -101,3 +106,33 @@ class ColumbiaCrawlerDownloaderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class WikiDumpDownloaderMiddleware(object):
+    """Answers Wikipedia api.php search and extracts requests from a local dump index
+    (see scripts/wiki_dump_index.py) instead of downloading them. Enabled by WIKI_DUMP_INDEX in config."""
+
+    def __init__(self, index):
+        self.index = index
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from cu_catalog import config
+        if not config.WIKI_DUMP_INDEX:
+            raise NotConfigured
+        from columbia_crawler.wiki_dump import WikiDumpIndex
+        s = cls(WikiDumpIndex(config.WIKI_DUMP_INDEX))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def process_request(self, request, spider):
+        url = urllib.parse.urlparse(request.url)
+        if url.netloc != 'en.wikipedia.org' or url.path != '/w/api.php':
+            return None
+        params = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        body = json.dumps(self.index.api_query(params))
+        return TextResponse(request.url, body=body, encoding='utf-8', request=request,
+                            headers={'Content-Type': 'application/json'})
+
+    def spider_opened(self, spider):
+        spider.logger.info('Answering Wikipedia API requests from dump index: %s' % self.index.filename)
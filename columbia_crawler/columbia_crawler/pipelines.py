@@ -260,8 +260,10 @@ class StoreWikiSearchResultsPipeline(BaseInstructorEnrichmentPipeline):
 
         elif isinstance(item, WikipediaInstructorPotentialArticle):
             logger.debug(f"Processing Wikipedia potential article for instructor: {item.get('name', 'Unknown')}")
-            s = json.dumps(item.to_dict())
-            self.file_wiki_article.write(s + '\n')
+            # intro sections would mix with full pages in the article classifier training data
+            if not item.get('intro_only'):
+                s = json.dumps(item.to_dict())
+                self.file_wiki_article.write(s + '\n')
 
         elif isinstance(item, WikipediaInstructorArticle):
             wikipedia_link = 'https://en.wikipedia.org/wiki/' \
@@ -299,6 +301,20 @@ class StoreCulpaSearchPipeline(BaseInstructorEnrichmentPipeline):
             'culpa_reviews_count': 'instructor_culpa_reviews_count',
         }
 
+    @staticmethod
+    def merge_reviews(known: list, new: list) -> list:
+        """Adds new reviews to known ones, newest first. Reviews with the same fingerprint are kept once
+
+        >>> known = [{'publish_date': '2019-01-02', 'text': 'b'}, {'publish_date': '2018-05-01', 'text': 'a'}]
+        >>> new = [{'publish_date': '2020-02-02', 'text': 'c'}, {'publish_date': '2019-01-02', 'text': 'b'}]
+        >>> [r['text'] for r in StoreCulpaSearchPipeline.merge_reviews(known, new)]
+        ['c', 'b', 'a']
+        """
+        merged = {}
+        for review in new + (known if isinstance(known, list) else []):
+            merged.setdefault(CulpaInstructor.Review.fingerprint(review), review)
+        return sorted(merged.values(), key=lambda r: r['publish_date'], reverse=True)
+
     def process_item(self, item, spider):
         if isinstance(item, CulpaInstructor):
             logger.info(f"Processing CULPA data for instructor: {item['name']}")
@@ -309,9 +325,15 @@ class StoreCulpaSearchPipeline(BaseInstructorEnrichmentPipeline):
                 logger.info(f"Found {matches_count} matching instructors for {item['name']}")
                 self.instr_df.loc[slice, 'culpa_link'] = item['link']
                 self.instr_df.loc[slice, 'culpa_nugget'] = item['nugget']
-                self.instr_df.loc[slice, 'culpa_reviews_count'] = len(item['reviews'])
-                self.instr_df.loc[slice, 'culpa_reviews'] = pd.Series([item['reviews']] * len(slice))
-                logger.info(f"Updated CULPA data: {item['link']} with {len(item['reviews'])} reviews")
+                reviews = item['reviews']
+                if item.get('reviews_incremental'):
+                    reviews = self.merge_reviews(cudata.load_culpa_reviews(item['link']), reviews)
+                # reviews are stored apart from instructors, see cudata.load_culpa_reviews()
+                if isinstance(reviews, list):
+                    cudata.store_culpa_reviews(item['link'], reviews)
+                self.instr_df.loc[slice, 'culpa_reviews_count'] = len(reviews)
+                logger.info(f"Updated CULPA data: {item['link']} with {len(reviews)} reviews "
+                            f"({len(item['reviews'])} parsed)")
             else:
                 logger.warning(f"No matching instructors found for CULPA data: {item['name']}")
         else:
@@ -0,0 +1,127 @@
+import datetime
+import logging
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TERM_SEASONS = {'spring': 0, 'summer': 1, 'fall': 2}
+
+
+def term_sort_key(term: str):
+    """
+    >>> sorted(['2021-Fall', '2021-Spring', '2020-Fall', '2021-Summer'], key=term_sort_key)
+    ['2020-Fall', '2021-Spring', '2021-Summer', '2021-Fall']
+    """
+    year, season = term.split('-', 1)
+    return int(year), TERM_SEASONS.get(season.lower(), -1)
+
+
+def current_terms(df: pd.DataFrame, num_terms: int = 2) -> List[str]:
+    """Latest terms found in instructors' `classes` lists
+
+    >>> df = pd.DataFrame({'classes': [[['2020-Fall', 'A'], ['2021-Spring', 'B']], [['2019-Fall', 'C']], None]})
+    >>> current_terms(df)
+    ['2021-Spring', '2020-Fall']
+    """
+    terms = {t for classes in df['classes'] if isinstance(classes, list) for t, _ in classes}
+    return sorted(terms, key=term_sort_key, reverse=True)[:num_terms]
+
+
+def teaching_activity(df: pd.DataFrame, terms: List[str], saturation: int = 3) -> pd.Series:
+    """Number of classes taught in `terms` scaled to 0..1
+
+    >>> df = pd.DataFrame({'classes': [[['2020-Fall', 'A'], ['2021-Spring', 'B']], [['2019-Fall', 'C']], None]})
+    >>> list(teaching_activity(df, ['2021-Spring', '2020-Fall'], saturation=2))
+    [1.0, 0.0, 0.0]
+    """
+    terms = set(terms)
+
+    def _count(classes):
+        if not isinstance(classes, list):
+            return 0
+        return sum(1 for t, _ in classes if t in terms)
+    return (df['classes'].apply(_count) / saturation).clip(upper=1.0).astype(float)
+
+
+def department_hit_rate(df: pd.DataFrame, found_field: str) -> pd.Series:
+    """Fraction of instructors with `found_field` set among instructors of the same departments.
+    For instructors of several departments the best department counts.
+
+    >>> df = pd.DataFrame({'departments': [['Math'], ['Math'], ['Math', 'Art'], ['Art']], \
+                           'link': ['x', None, None, None]})
+    >>> [round(x, 2) for x in department_hit_rate(df, 'link')]
+    [0.33, 0.33, 0.33, 0.0]
+    """
+    found = df[found_field].notna()
+    exploded = pd.DataFrame({'department': df['departments'], 'found': found}).explode('department')
+    rates = exploded.groupby('department')['found'].mean()
+
+    def _rate(departments):
+        if not isinstance(departments, (list, set)) or len(departments) == 0:
+            return 0.0
+        return max(rates.get(d, 0.0) for d in departments)
+    return df['departments'].apply(_rate).astype(float)
+
+
+def reviews_rate(df: pd.DataFrame, saturation: int = 10) -> pd.Series:
+    """Reviews per term taught scaled to 0..1: popular instructors get new CULPA reviews more often
+
+    >>> df = pd.DataFrame({'culpa_reviews_count': [20, 1, None], \
+                           'classes': [[['2020-Fall', 'A'], ['2021-Spring', 'B']], [['2019-Fall', 'C']], None]})
+    >>> list(reviews_rate(df))
+    [1.0, 0.1, 0.0]
+    """
+    terms = df['classes'].apply(lambda classes: len({t for t, _ in classes}) if isinstance(classes, list) else 0)
+    rate = df['culpa_reviews_count'].astype(float).fillna(0.0) / terms.clip(lower=1)
+    return (rate / saturation).clip(upper=1.0)
+
+
+class RefreshScheduler:
+    """Picks instructors to refresh from an external source (Wikipedia, CULPA) within a daily request budget.
+
+    Instructors checked less than `min_days` ago are skipped. The rest are ranked by a weighted sum of
+    staleness (days since the last check, saturates at `stale_days`), teaching activity in current terms
+    and the expected hit rate, and the top `budget` of them are returned in priority order.
+    """
+    def __init__(self, internal_db, field: str, min_days: int, budget: int, stale_days: int = 180,
+                 weights=(1.0, 1.0, 1.0)):
+        self.internal_db = internal_db
+        self.field = field
+        self.min_days = min_days
+        self.budget = budget
+        self.stale_days = stale_days
+        self.weights = weights
+
+    def staleness(self, df: pd.DataFrame) -> pd.Series:
+        last = self.internal_db.df_internal.drop_duplicates('name').set_index('name')
+        last = pd.to_datetime(last[self.field]).reindex(df['name']) if self.field in last.columns \
+            else pd.Series(pd.NaT, index=df['name'])
+        days = (pd.Timestamp(datetime.datetime.now()) - last).dt.total_seconds() / 86400
+        # never checked instructors are the most stale
+        days = days.fillna(self.stale_days)
+        return pd.Series((days / self.stale_days).clip(0.0, 1.0).values, index=df.index)
+
+    def schedule(self, df: pd.DataFrame, hit_rate: pd.Series = None) -> pd.DataFrame:
+        """Returns rows of `df` to refresh today, most promising first"""
+        terms = current_terms(df)
+        due = self.internal_db.due_instructors(df['name'], self.field, self.min_days, self.min_days)
+        df = df[df['name'].isin(due)]
+        if len(df) == 0:
+            return df
+
+        w_stale, w_active, w_hit = self.weights
+        activity = teaching_activity(df, terms)
+        if hit_rate is None:
+            hit_rate = pd.Series(0.0, index=df.index)
+        score = w_stale * self.staleness(df) \
+            + w_active * activity \
+            + w_hit * hit_rate.reindex(df.index).fillna(0.0)
+
+        # stable order for equal scores
+        order = np.lexsort((df['name'].values, -score.values))
+        scheduled = df.iloc[order[:self.budget]]
+        logger.info("Scheduled %s out of %s instructors due for %s", len(scheduled), len(df), self.field)
+        return scheduled
@@ -1,22 +1,72 @@
 import datetime
+import json
 import logging
+import os
 from typing import List
 
 import pandas as pd
-import random
 import urllib
 import scrapy
 from scrapy import Request
 from parsel.selector import SelectorList
 
-from columbia_crawler import util
+from columbia_crawler import scheduler, util
 from columbia_crawler.items import CulpaInstructor
 from cu_catalog import config
-from cu_catalog.models.util import words_match2
+import cu_catalog.models.cudata as cudata
+from cu_catalog.models.entity_resolution import EntityResolver
+from cu_catalog.models.util import NormalizedName, words_match2
 
 logger = logging.getLogger(__name__)
 
 
+def _counter(review_html, counter_name: str) -> int:
+    counter = review_html.css('input.' + counter_name + '::attr(value)').get() or ''
+    count = ''.join(filter(lambda i: i.isdigit(), counter))
+    return int(count) if count else 0
+
+
+def parse_culpa_review(review_html) -> CulpaInstructor.Review:
+    """Parses review card from CULPA professor page. All selectors are relative to the card,
+    so parsing a page takes time proportional to its size, not to reviews count times page size."""
+    course_codes = []
+    # note single review may belong to multiple courses
+    for meta in review_html.xpath('.//li/a[contains(@href, "/course")]'):
+        course_name = meta.css('::text').get()
+        course_code = None  # no way to get course code at the moment
+        crs = {}
+        if course_code:
+            crs['c'] = course_code
+        if course_name:
+            crs['t'] = course_name
+        course_codes.append(crs)
+
+    review_extracted = review_html.css('.review_content ::text').getall()
+    review_extracted = [r.strip() for r in review_extracted if len(r.strip()) > 0]
+
+    if 'Workload:' in review_extracted:
+        text = review_extracted[:review_extracted.index('Workload:')]
+        workload = review_extracted[review_extracted.index('Workload:')+1:]
+        workload = "\n".join(workload)
+    else:
+        text = review_extracted
+        workload = None
+    text = "\n".join(text)
+
+    pub_date = review_html.css('p.date::text').get().strip()
+    pub_date = datetime.datetime.strptime(pub_date, '%B %d, %Y').date()
+
+    return CulpaInstructor.Review(
+        text=text,
+        workload=workload,
+        course_codes=course_codes,
+        publish_date=pub_date,
+        agree_count=_counter(review_html, 'agree'),
+        disagree_count=_counter(review_html, 'disagree'),
+        funny_count=_counter(review_html, 'funny')
+    )
+
+
 class CulpaSearchSpider(scrapy.Spider):
     name = 'culpa_search'
     #SITE = 'localhost:8801'
@@ -34,16 +84,20 @@ class CulpaSearchSpider(scrapy.Spider):
     def __init__(self, *args, **kwargs):
         super(CulpaSearchSpider, self).__init__(*args, **kwargs)
         self.instructors_internal_db = None
+        # not used in contracts, where names are matched directly
+        self.entity_resolver = None
 
     def start_requests(self):
         self.crawler.stats.set_value('culpa_searches', 0)
         self.crawler.stats.set_value('culpa_profiles_loaded', 0)
+        self.crawler.stats.set_value('culpa_resolved_locally', 0)
+        self.crawler.stats.set_value('culpa_reviews_parsed', 0)
 
-        df = pd.read_json(config.DATA_INSTRUCTORS_JSON)
+        self.df = pd.read_json(config.DATA_INSTRUCTORS_JSON)
 
-        # join internal db to store last check and don't check too often
-        self.instructors_internal_db = util.InstructorsInternalDb(['last_culpa_search', 'last_culpa_profile'])
-        self.df = df.join(self.instructors_internal_db.df_internal.set_index('name'), on="name")
+        # use internal db to store last check and don't check too often
+        self.instructors_internal_db = util.open_instructors_internal_db(['last_culpa_search', 'last_culpa_profile'])
+        self.entity_resolver = EntityResolver(config.DATA_ENTITY_RESOLUTION_DB, self.df['name'])
 
         # get fresh list of culpa ids
         yield Request('https://' + CulpaSearchSpider.SITE + '/browse_by_prof',
@@ -52,6 +106,7 @@ class CulpaSearchSpider(scrapy.Spider):
     def close(self, reason):
         if self.instructors_internal_db is not None:
             self.instructors_internal_db.store()
+            self.instructors_internal_db.close()
 
     def _search_culpa_instructor(self, instructor: str, departments: List[str], catalog_name=None):
         if catalog_name is None:
@@ -62,10 +117,20 @@ class CulpaSearchSpider(scrapy.Spider):
                        meta={'instructor': catalog_name,
                              'departments': departments})
 
-    def _check_culpa_instructor_profile(self, instructor: str, url: str):
-        return Request(url, callback=self.parse_culpa_instructor,
-                      meta={'instructor': instructor,
-                            'link': url})
+    def _check_culpa_instructor_profile(self, instructor: str, url: str, incremental: bool = False):
+        meta = {'instructor': instructor,
+                'link': url}
+        if incremental and config.CULPA_INCREMENTAL_REVIEWS and not getattr(self, 'full_reviews', False):
+            known_reviews = cudata.load_culpa_reviews(url)
+            # reviews parsed by an older parser (e.g. migrated ones) are replaced by a full parse once
+            if not all(CulpaInstructor.Review.is_current(r) for r in known_reviews):
+                known_reviews = []
+        else:
+            known_reviews = []
+        if len(known_reviews) > 0:
+            meta['known_reviews'] = [CulpaInstructor.Review.fingerprint(r) for r in known_reviews]
+            meta['known_reviews_newest'] = max(r['publish_date'] for r in known_reviews)
+        return Request(url, callback=self.parse_culpa_instructor, meta=meta)
 
     def get_culpa_id_by_name(self, name):
         if name in self.prof_name2culpa_id:
@@ -73,45 +138,88 @@ class CulpaSearchSpider(scrapy.Spider):
         else:
             return None
 
+    @staticmethod
+    def _load_profs_list() -> dict:
+        if not os.path.exists(config.DATA_CULPA_PROFS_JSON):
+            return {}
+        with open(config.DATA_CULPA_PROFS_JSON, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _store_profs_list(prof_name2culpa_id: dict):
+        os.makedirs(os.path.dirname(config.DATA_CULPA_PROFS_JSON), exist_ok=True)
+        tmp_filename = config.DATA_CULPA_PROFS_JSON + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(prof_name2culpa_id, f, indent=0, sort_keys=True)
+        os.replace(tmp_filename, config.DATA_CULPA_PROFS_JSON)
+
+    def _culpa_links_by_instructor(self) -> dict:
+        """Resolves CULPA professor names to catalog instructors, returns instructor -> CULPA links"""
+        links = {}
+        for culpa_name, instructors in self.entity_resolver.resolve_many('culpa', self.prof_name2culpa_id).items():
+            for instructor in instructors:
+                links.setdefault(instructor, []).append(self.prof_name2culpa_id[culpa_name])
+        return links
+
+    @staticmethod
+    def _parse_profs_list(response) -> dict:
+        """Map of all prof names -> culpa_id. Entries without name can't be matched to instructors and are dropped"""
+        profs = {}
+        for r in response.css('p span a'):
+            name = r.css('a::text').get()
+            link = r.css('a::attr(href)').get()
+            if name and name.strip() and link:
+                profs[name] = link
+        return profs
+
     def parse_culpa_profs_list(self, response):
-        # get map of all prof names -> culpa_id
-        self.prof_name2culpa_id = {r.css('a::text').get(): r.css('a::attr(href)').get()
-                                   for r in response.css('p span a')}
-
-        # # select instructors without link
-        # df_nolink = self.df[self.df['culpa_link'].isnull()]
-        #
-        # # select instructors that were not checked for a few days
-        # def recent_threshold(x):
-        #     if pd.isna(x):
-        #         return True
-        #     return x < datetime.datetime.now() - datetime.timedelta(days=random.randint(3, 7))
-        # df_nolink = df_nolink[df_nolink['last_culpa_search'].apply(recent_threshold)]
-        #
-        # # yield instructors without links
-        # def _yield(x):
-        #     _, row = x
-        #     self.instructors_internal_db.update_instructor(row['name'], 'last_culpa_search')
-        #     return self._search_culpa_instructor(row['name'], row['departments'])
-        # yield from util.spider_run_loop(self, df_nolink.iterrows(), _yield)
+        self.prof_name2culpa_id = self._parse_profs_list(response)
+        if len(self.prof_name2culpa_id) > 0:
+            self._store_profs_list(self.prof_name2culpa_id)
+        else:
+            logger.warning("No professors found on %s, using the list from the last run", response.url)
+            self.prof_name2culpa_id = self._load_profs_list()
+
+        # search instructors without link: opt-in with `-a search_unlinked=1`
+        if getattr(self, 'search_unlinked', False):
+            culpa_links = self._culpa_links_by_instructor()
+            df_nolink = self.df[self.df['culpa_link'].isnull()]
+
+            # select instructors that were not checked for a few days
+            due = self.instructors_internal_db.due_instructors(df_nolink['name'], 'last_culpa_search', 3, 7)
+            df_nolink = df_nolink[df_nolink['name'].isin(due)]
+
+            # names found in professors list are checked right away, only the rest is searched
+            def _yield(x):
+                _, row = x
+                self.instructors_internal_db.update_instructor(row['name'], 'last_culpa_search')
+                links = culpa_links.get(row['name'], [])
+                if len(links) > 1:
+                    logger.warning("More than 1 CULPA professor for '%s': %s", row['name'], links)
+                if len(links) > 0:
+                    self.crawler.stats.inc_value('culpa_resolved_locally')
+                    return self._check_culpa_instructor_profile(row['name'], 'http://' + CulpaSearchSpider.SITE
+                                                                + links[0])
+                return self._search_culpa_instructor(row['name'], row['departments'])
+            yield from util.spider_run_loop(self, df_nolink.iterrows(), _yield)
 
         # check profiles of instructors with links
         df_link = self.df[self.df['culpa_link'].notnull()]
-
-        def recent_threshold(x):
-            if pd.isna(x):
-                return True
-            return x < datetime.datetime.now() - datetime.timedelta(days=random.randint(3, 7))
-        df_link = df_link[
-            df_link['last_culpa_profile'].apply(recent_threshold)
-        ]
+        budget = int(getattr(self, 'budget', config.CULPA_DAILY_BUDGET))
+        df_link = scheduler.RefreshScheduler(self.instructors_internal_db, 'last_culpa_profile', 3, budget) \
+            .schedule(df_link, scheduler.reviews_rate(df_link))
 
         def _yield(x):
             _, row = x
             self.instructors_internal_db.update_instructor(row['name'], 'last_culpa_profile')
-            return self._check_culpa_instructor_profile(row['name'], row['culpa_link'])
+            return self._check_culpa_instructor_profile(row['name'], row['culpa_link'], incremental=True)
         yield from util.spider_run_loop(self, df_link.iterrows(), _yield)
 
+    def _name_matches(self, instructor: NormalizedName, culpa_name: str) -> bool:
+        if self.entity_resolver is None:
+            return words_match2(instructor, culpa_name)
+        return self.entity_resolver.is_match('culpa', culpa_name, instructor.name)
+
     def parse_culpa_search_instructor(self, response):
         """
         @url http://culpa.info/search?utf8=%E2%9C%93&search=Ismail+C+Noyan&commit=Search
@@ -133,9 +241,10 @@ class CulpaSearchSpider(scrapy.Spider):
         # sort out not matching names
         if found:
             found_matching_names = SelectorList([])
+            instructor_name = NormalizedName.of(instructor)
             for result in found:
                 found_name = result.css('a::text').get()
-                if found_name and words_match2(instructor, found_name):
+                if found_name and self._name_matches(instructor_name, found_name):
                     found_matching_names.append(result)
             if len(found_matching_names) > 1:
                 logger.warning("More than 1 result for '%s' from %s on CULPA",
@@ -171,60 +280,23 @@ class CulpaSearchSpider(scrapy.Spider):
             if "SILVER" in nugget_text.upper():
                 nugget = CulpaInstructor.NUGGET_SILVER
 
-        # extract reviews
+        # extract reviews, newest go first. When stored reviews are known, stop at the first of them
+        known = set(response.meta.get('known_reviews', []))
+        newest = response.meta.get('known_reviews_newest')
         reviews = []
-        reviews_html = response.css('div.card div.card-body')
-        for review_html in reviews_html:
-            course_codes = []
-            # note single review may belong to multiple courses
-            for meta in review_html.xpath('//li/a[contains(@href, "/course")]'):
-                course_name = meta.css('::text').get()
-                course_code = None  # no way to get course code at the moment
-                crs = {}
-                if course_code:
-                    crs['c'] = course_code
-                if course_name:
-                    crs['t'] = course_name
-
-                course_codes.append(crs)
-
-            review_extracted = review_html.css('.review_content ::text').getall()
-            review_extracted = [r.strip() for r in review_extracted if len(r.strip()) > 0]
-
-            if 'Workload:' in review_extracted:
-                text = review_extracted[:review_extracted.index('Workload:')]
-                workload = review_extracted[review_extracted.index('Workload:')+1:]
-                workload = "\n".join(workload)
-            else:
-                text = review_extracted
-                workload = None
-            text = "\n".join(text)
-
-            pub_date = review_html.css('p.date::text').get().strip()
-            pub_date = datetime.datetime.strptime(pub_date, '%B %d, %Y').date()
-
-            def _get_counter(counter_name: str) -> int:
-                counter = review_html.css('input.' + counter_name + '::attr(value)').get()
-                count = ''.join(filter(lambda i: i.isdigit(), counter))
-                return int(count) if count else 0
-            agree_count = _get_counter('agree')
-            disagree_count = _get_counter('disagree')
-            funny_count = _get_counter('funny')
-
-            review = CulpaInstructor.Review(
-                text=text,
-                workload=workload,
-                course_codes=course_codes,
-                publish_date=pub_date,
-                agree_count=agree_count,
-                disagree_count=disagree_count,
-                funny_count=funny_count
-            )
-            reviews.append(review.to_dict())
-
-        yield CulpaInstructor(
+        for review_html in response.css('div.card div.card-body'):
+            review = parse_culpa_review(review_html).to_dict()
+            if review['publish_date'] < (newest or '') or CulpaInstructor.Review.fingerprint(review) in known:
+                break
+            reviews.append(review)
+        self.crawler.stats.inc_value('culpa_reviews_parsed', len(reviews))
+
+        item = CulpaInstructor(
             name=response.meta.get('instructor'),
             link=response.meta.get('link'),
             reviews=reviews,
             nugget=nugget
         )
+        if newest is not None:
+            item['reviews_incremental'] = True
+        yield item
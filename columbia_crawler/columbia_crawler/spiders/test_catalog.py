@@ -1,13 +1,18 @@
+from unittest import TestCase
+
 from betamax import Betamax
 from betamax.fixtures.unittest import BetamaxTestCase
 from scrapy import Request
 from scrapy.crawler import Crawler
 from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
 import os.path
 
-from columbia_crawler.items import ColumbiaDepartmentListing, ColumbiaClassListing
+from columbia_crawler.items import ColumbiaDepartmentListing, ColumbiaClassListing, CulpaInstructor
+from columbia_crawler.pipelines import StoreCulpaSearchPipeline
 from columbia_crawler.spiders.catalog import CatalogSpider
 from columbia_crawler.spiders.culpa_search import CulpaSearchSpider
+import cu_catalog.models.cudata as cudata
 
 with Betamax.configure() as config:
     # where betamax will store cassettes (http responses):
@@ -237,3 +242,65 @@ class TestCatalogSpider(BetamaxTestCase):
         self.assertEqual(results_prof, [{'link': 'http://culpa.info/professors/10941',
                                  'name': 'Aftab Ahmad',
                                  'nugget': 'gold'}])
+
+
+class TestCulpaSearchSpider(TestCase):
+    REVIEW_HTML = '''<div class="card"><div class="card-body">
+      <p class="date">{date}</p>
+      <div class="review_content"><p>{text}</p></div>
+    </div></div>'''
+
+    def _profile_response(self, reviews, meta):
+        body = '<html><body>' + ''.join(self.REVIEW_HTML.format(date=date, text=text) for date, text in reviews) \
+               + '</body></html>'
+        url = 'http://culpa.info/professors/1'
+        request = Request(url, meta={'instructor': 'Jane Roe', 'link': url, **meta})
+        return HtmlResponse(url, body=body, encoding='utf-8', request=request)
+
+    def test_parse_profs_list(self):
+        body = '<html><body><p><span><a href="/professors/1">Jane Roe</a></span>' \
+               '<span><a href="/professors/2"></a></span><span><a href="/professors/3"> </a></span></p></body></html>'
+        response = HtmlResponse('http://culpa.info/browse_by_prof', body=body, encoding='utf-8')
+        self.assertEqual({'Jane Roe': '/professors/1'}, CulpaSearchSpider._parse_profs_list(response))
+
+    def test_parse_culpa_instructor_incremental(self):
+        culpa = get_crawler(CulpaSearchSpider)._create_spider()
+        known = [{'publish_date': '2019-03-03', 'text': 'Known'}, {'publish_date': '2018-01-01', 'text': 'Oldest'}]
+        meta = {'known_reviews': [CulpaInstructor.Review.fingerprint(r) for r in known],
+                'known_reviews_newest': '2019-03-03'}
+        page = [('March 5, 2020', 'New'), ('March 3, 2019', 'Same day'), ('March 3, 2019', 'Known'),
+                ('January 1, 2018', 'Oldest')]
+
+        # parsing stops at the first known review
+        results = list(culpa.parse_culpa_instructor(self._profile_response(page, meta)))
+        self.assertEqual(1, len(results))
+        item = results[0]
+        self.assertTrue(item['reviews_incremental'])
+        self.assertEqual(['New', 'Same day'], [r['text'] for r in item['reviews']])
+        merged = StoreCulpaSearchPipeline.merge_reviews(known, item['reviews'])
+        self.assertEqual(['New', 'Same day', 'Known', 'Oldest'], [r['text'] for r in merged])
+
+        # or at the first review older than known ones, e.g. when the known one was edited
+        page = [('March 5, 2020', 'New'), ('February 1, 2019', 'Known, edited')]
+        item = list(culpa.parse_culpa_instructor(self._profile_response(page, meta)))[0]
+        self.assertEqual(['New'], [r['text'] for r in item['reviews']])
+
+        # all reviews without known ones
+        item = list(culpa.parse_culpa_instructor(self._profile_response(page, {})))[0]
+        self.assertNotIn('reviews_incremental', item)
+        self.assertEqual(['New', 'Known, edited'], [r['text'] for r in item['reviews']])
+
+    def test_check_culpa_instructor_profile_outdated(self):
+        culpa = get_crawler(CulpaSearchSpider)._create_spider()
+        url = 'http://culpa.info/professors/1'
+        review = {'publish_date': '2019-03-03', 'text': 'Known'}
+
+        # reviews without parser version are parsed again in full
+        cudata.store_culpa_reviews(url, [review])
+        request = culpa._check_culpa_instructor_profile('Jane Roe', url, incremental=True)
+        self.assertNotIn('known_reviews', request.meta)
+
+        cudata.store_culpa_reviews(url, [{**review, 'parser_version': CulpaInstructor.Review.PARSER_VERSION}])
+        request = culpa._check_culpa_instructor_profile('Jane Roe', url, incremental=True)
+        self.assertEqual([CulpaInstructor.Review.fingerprint(review)], request.meta['known_reviews'])
+        self.assertEqual('2019-03-03', request.meta['known_reviews_newest'])
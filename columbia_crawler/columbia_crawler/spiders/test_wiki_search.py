@@ -0,0 +1,84 @@
+import asyncio
+import json
+import urllib.parse
+from unittest import TestCase, mock
+
+from scrapy import Request
+from scrapy.http import TextResponse
+from scrapy.utils.test import get_crawler
+
+from columbia_crawler.spiders.wiki_search import WikiSearchSpider
+
+
+class TestWikiSearchSpider(TestCase):
+
+    def _get_spider(self, **kwargs):
+        crawler = get_crawler(WikiSearchSpider)
+        crawler.spider = crawler._create_spider(**kwargs)
+        return crawler.spider
+
+    @staticmethod
+    def _articles_response(spider, articles, body):
+        request = Request('https://en.wikipedia.org/w/api.php', callback=spider.parse_wiki_articles,
+                          meta={'articles': articles})
+        return TextResponse(request.url, body=json.dumps(body), encoding='utf-8', request=request)
+
+    def test_parse_wiki_articles_requeue(self):
+        wiki = self._get_spider(article_batch_size='20', inference_batch_size='1')
+        for i in range(19):
+            wiki._queue_article('Pending %s' % i, 'Instructor %s' % i, 'Memology')
+
+        # extracts of two pages didn't fit into the response, the third one doesn't exist
+        articles = {
+            'Jane Roe': [{'instructor': 'Jane Roe', 'department': 'Memology'}],
+            'john_Doe': [{'instructor': 'John Doe', 'department': 'Memology'},
+                         {'instructor': 'Johnny Doe', 'department': 'Memology'}],
+            'Nobody': [{'instructor': 'No Body', 'department': 'Memology'}],
+        }
+        body = {'continue': {'excontinue': 1, 'continue': '||'},
+                'query': {'normalized': [{'from': 'john_Doe', 'to': 'John Doe'}],
+                          'pages': {'1': {'pageid': 1, 'ns': 0, 'title': 'Jane Roe'},
+                                    '2': {'pageid': 2, 'ns': 0, 'title': 'John Doe'},
+                                    '-1': {'ns': 0, 'title': 'Nobody', 'missing': ''}}}}
+        results = asyncio.run(wiki.parse_wiki_articles(self._articles_response(wiki, articles, body)))
+
+        # the batch filled up with the first page, the second one waits for the next batch
+        self.assertEqual(1, len(results))
+        request = results[0]
+        self.assertEqual(20, len(request.meta['articles']))
+        self.assertEqual([{'instructor': 'Jane Roe', 'department': 'Memology'}], request.meta['articles']['Jane Roe'])
+        self.assertIn(urllib.parse.quote_plus('Pending 0|'), request.url)
+        self.assertEqual({'john_Doe': [{'instructor': 'John Doe', 'department': 'Memology'},
+                                       {'instructor': 'Johnny Doe', 'department': 'Memology'}]},
+                         wiki.pending_articles)
+
+    def test_parse_wiki_articles_complete(self):
+        wiki = self._get_spider(article_batch_size='20', inference_batch_size='1')
+        articles = {'Jane Roe': [{'instructor': 'Jane Roe', 'department': 'Memology'}]}
+        body = {'batchcomplete': '',
+                'query': {'pages': {'1': {'pageid': 1, 'ns': 0, 'title': 'Jane Roe'}}}}
+
+        # pages without extract in a complete response are not fetched again
+        results = asyncio.run(wiki.parse_wiki_articles(self._articles_response(wiki, articles, body)))
+        self.assertEqual([], results)
+        self.assertEqual({}, wiki.pending_articles)
+
+    def test_parse_wiki_articles_intro_only(self):
+        wiki = self._get_spider(article_batch_size='20', inference_batch_size='1')
+        articles = {'Jane Roe': [{'instructor': 'Jane Roe', 'department': 'Memology'}]}
+        body = {'batchcomplete': '',
+                'query': {'pages': {'1': {'pageid': 1, 'ns': 0, 'title': 'Jane Roe', 'extract': 'Jane Roe is'}}}}
+
+        class FakeClassifier:
+            LABEL_RELEVANT = 1
+
+            @staticmethod
+            def predict(rows):
+                return [0] * len(rows)
+
+        # multi-title queries return intros, they are marked so they don't go into training data
+        with mock.patch.object(WikiSearchSpider, 'article_clf', FakeClassifier()):
+            results = asyncio.run(wiki.parse_wiki_articles(self._articles_response(wiki, articles, body)))
+        self.assertEqual(1, len(results))
+        self.assertEqual('Jane Roe is', results[0]['wikipedia_raw_page'])
+        self.assertTrue(results[0]['intro_only'])
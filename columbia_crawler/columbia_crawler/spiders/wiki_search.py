@@ -1,22 +1,37 @@
-import datetime
 import json
 import logging
-import random
+import threading
 
 import pandas as pd
 import scrapy
-from scrapy import Request
+from scrapy import Request, signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.defer import maybe_deferred_to_future
 import urllib
 
-from columbia_crawler import util
+from columbia_crawler import scheduler, util
+from columbia_crawler.inference import BatchInferenceService
 from columbia_crawler.items import WikipediaInstructorSearchResults, WikipediaInstructorPotentialArticle, \
     WikipediaInstructorArticle
 from cu_catalog import config
-from cu_catalog.models.wiki_article import WikiArticleClassifier
-from cu_catalog.models.wiki_search import WikiSearchClassifier, WSC
 
 logger = logging.getLogger(__name__)
 
+# Classifiers are loaded on first use and shared by all spider instances in the process.
+# Models modules are imported lazily too: they pull in torch and transformers.
+_shared_models = {}
+_shared_models_lock = threading.Lock()
+
+
+def _shared_model(model_class):
+    with _shared_models_lock:
+        if model_class not in _shared_models:
+            logger.info("Loading model %s", model_class.__name__)
+            model = model_class()
+            model.load_model()
+            _shared_models[model_class] = model
+        return _shared_models[model_class]
+
 
 # Spider for searching instructors wikipedia profiles
 class WikiSearchSpider(scrapy.Spider):
@@ -28,34 +43,63 @@ class WikiSearchSpider(scrapy.Spider):
         'LOG_LEVEL': config.LOG_LEVEL,
         'ITEM_PIPELINES': {
             'columbia_crawler.pipelines.StoreWikiSearchResultsPipeline': 400,
-        }
+        },
+        # answers api.php requests locally when WIKI_DUMP_INDEX is set (before http cache)
+        'DOWNLOADER_MIDDLEWARES': {
+            'columbia_crawler.middlewares.WikiDumpDownloaderMiddleware': 50,
+        },
     }
 
     def __init__(self, *args, **kwargs):
         super(WikiSearchSpider, self).__init__(*args, **kwargs)
-        self.search_clf = WikiSearchClassifier()
-        self.search_clf.load_model()
-        self.article_clf = WikiArticleClassifier()
-        self.article_clf.load_model()
         self.instructors_internal_db = None
+        # spider arguments override the configured batch sizes, 1 disables batching
+        self.inference_batch_size = int(getattr(self, 'inference_batch_size', config.WIKI_INFERENCE_BATCH_SIZE))
+        self.article_batch_size = int(getattr(self, 'article_batch_size', config.WIKI_ARTICLE_BATCH_SIZE))
+        # batched inference services by classifier
+        self.inference = {}
+        # articles waiting to be fetched in one multi-title query: title -> list of instructor contexts
+        self.pending_articles = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(WikiSearchSpider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    def spider_idle(self):
+        # fetch articles left in an incomplete batch
+        if len(self.pending_articles) > 0:
+            self.crawler.engine.crawl(self._flush_articles())
+            raise DontCloseSpider
+
+    @property
+    def search_clf(self):
+        from cu_catalog.models.wiki_search import WikiSearchClassifier
+        return _shared_model(WikiSearchClassifier)
+
+    @property
+    def article_clf(self):
+        from cu_catalog.models.wiki_article import WikiArticleClassifier
+        return _shared_model(WikiArticleClassifier)
 
     def start_requests(self):
         self.crawler.stats.set_value('wiki_articles_loaded', 0)
         self.crawler.stats.set_value('wiki_searches', 0)
+        self.crawler.stats.set_value('wiki_prefilter_passed', 0)
+        self.crawler.stats.set_value('wiki_prefilter_rejected', 0)
 
         df = pd.read_json(config.DATA_INSTRUCTORS_JSON)
 
-        # join internal db to store last check and don't check too often
-        self.instructors_internal_db = util.InstructorsInternalDb(['last_wikipedia_search'])
+        # use internal db to store last check and don't check too often
+        self.instructors_internal_db = util.open_instructors_internal_db(['last_wikipedia_search'])
 
+        # departments with many instructors on wikipedia are more likely to have more
+        hit_rate = scheduler.department_hit_rate(df, 'wikipedia_link')
         df = df[df['wikipedia_link'].isnull()]
-        df = df.join(self.instructors_internal_db.df_internal.set_index('name'), on="name")
-        df['last_wikipedia_search'] = pd.to_datetime(df['last_wikipedia_search'], unit='ms')
-
-        # filter out recently checked instructors
-        def recent_threshold(x):
-            return x < datetime.datetime.now() - datetime.timedelta(days=random.randint(15, 45))
-        df = df[df['last_wikipedia_search'].isna() | df['last_wikipedia_search'].apply(recent_threshold)]
+        budget = int(getattr(self, 'budget', config.WIKI_DAILY_BUDGET))
+        df = scheduler.RefreshScheduler(self.instructors_internal_db, 'last_wikipedia_search', 15, budget) \
+            .schedule(df, hit_rate)
 
         def _yield(x):
             _, row = x
@@ -76,8 +120,20 @@ class WikiSearchSpider(scrapy.Spider):
     def close(self, reason):
         if self.instructors_internal_db is not None:
             self.instructors_internal_db.store()
+            self.instructors_internal_db.close()
+
+    async def _classify(self, clf, stats_prefix, rows):
+        """Predicted labels of rows, classified together with rows of other callbacks
+        when batched inference is enabled."""
+        if self.inference_batch_size <= 1:
+            return clf.predict(rows)
+        if clf not in self.inference:
+            self.inference[clf] = BatchInferenceService(
+                clf, self.inference_batch_size, config.WIKI_INFERENCE_MAX_DELAY,
+                self.crawler.stats, stats_prefix)
+        return await maybe_deferred_to_future(self.inference[clf].predict(rows))
 
-    def parse_wiki_instructor_search_results(self, response):
+    async def parse_wiki_instructor_search_results(self, response):
         """ Starting with department list, crawl all listings by each department.
 
         @url https://en.wikipedia.org/w/api.php?action=query&list=search&utf8=&format=json&srsearch=Columbia+University+intitle%3ATanya+Zelevinsky
@@ -95,14 +151,13 @@ class WikiSearchSpider(scrapy.Spider):
         logger.debug('WIKI: Search results for %s : %s', instructor, search)
 
         if len(search) == 0:
-            return
+            return []
 
-        # yield search result item
+        # search result item
         sr = WikipediaInstructorSearchResults()
         sr['name'] = instructor
         sr['department'] = department
         sr['search_results'] = search
-        yield sr
 
         # use classifier to find match or possible match
         rows = []
@@ -117,30 +172,119 @@ class WikiSearchSpider(scrapy.Spider):
             }
             rows.append(row)
 
+        # cheap prefilter rejects clearly irrelevant results without running the model
+        from cu_catalog.models.wiki_search import WikiSearchClassifier
+        passed = [i for i, row in enumerate(rows)
+                  if not config.WIKI_PREFILTER_ENABLED or WikiSearchClassifier.prefilter(row)]
+        self.crawler.stats.inc_value('wiki_prefilter_passed', len(passed))
+        self.crawler.stats.inc_value('wiki_prefilter_rejected', len(rows) - len(passed))
+
         # see if we found worthy items
-        pred = self.search_clf.predict(rows)
-        for p, row in zip(pred, rows):
-            if p == WSC.LABEL_RELEVANT:
-                yield WikipediaInstructorArticle(
-                    name=instructor,
-                    department=department,
-                    wikipedia_title=row['search_results.title'])
-                break
-            if p == WSC.LABEL_POSSIBLY:
-                self.crawler.stats.inc_value('wiki_articles_loaded')
-                url = 'https://en.wikipedia.org/w/api.php?' \
-                      'format=json&action=query&prop=extracts&exlimit=max&' \
-                      'explaintext&titles='\
-                      + urllib.parse.quote_plus(row['search_results.title']) \
-                      + '&redirects='
-                yield Request(url, callback=self.parse_wiki_article_prof,
-                              meta={**response.meta,
-                                    'instructor': instructor,
-                                    'department': department,
-                                    'wiki_title': row['search_results.title']})
+        def _on_predicted(pred_passed):
+            pred = [WikiSearchClassifier.LABEL_IRRELEVANT] * len(rows)
+            for i, p in zip(passed, pred_passed):
+                pred[i] = p
+            yield sr
+            for p, row in zip(pred, rows):
+                if p == WikiSearchClassifier.LABEL_RELEVANT:
+                    yield WikipediaInstructorArticle(
+                        name=instructor,
+                        department=department,
+                        wikipedia_title=row['search_results.title'])
+                    break
+                if p == WikiSearchClassifier.LABEL_POSSIBLY:
+                    self.crawler.stats.inc_value('wiki_articles_loaded')
+                    if self.article_batch_size > 1:
+                        request = self._queue_article(row['search_results.title'], instructor, department)
+                        if request is not None:
+                            yield request
+                        continue
+                    url = 'https://en.wikipedia.org/w/api.php?' \
+                          'format=json&action=query&prop=extracts&exlimit=max&' \
+                          'explaintext&titles='\
+                          + urllib.parse.quote_plus(row['search_results.title']) \
+                          + '&redirects='
+                    yield Request(url, callback=self.parse_wiki_article_prof,
+                                  meta={**response.meta,
+                                        'instructor': instructor,
+                                        'department': department,
+                                        'wiki_title': row['search_results.title']})
+        if len(passed) == 0:
+            return list(_on_predicted([]))
+        return list(_on_predicted(await self._classify(self.search_clf, 'wiki_search_', [rows[i] for i in passed])))
+
+    def _queue_article(self, title: str, instructor: str, department: str):
+        """Adds article to the next multi-title query. Returns the query request once the batch is full."""
+        self.pending_articles.setdefault(title, []).append({'instructor': instructor, 'department': department})
+        if len(self.pending_articles) >= min(self.article_batch_size, 20):
+            return self._flush_articles()
+        return None
+
+    def _flush_articles(self):
+        articles, self.pending_articles = self.pending_articles, {}
+        self.crawler.stats.inc_value('wiki_article_queries')
+        # extracts of many pages at once are only returned for intro sections (max 20 per query)
+        url = 'https://en.wikipedia.org/w/api.php?' \
+              'format=json&action=query&prop=extracts&exlimit=max&exintro&' \
+              'explaintext&redirects=&titles=' \
+              + urllib.parse.quote_plus('|'.join(articles.keys()))
+        return Request(url, callback=self.parse_wiki_articles, meta={'articles': articles})
+
+    async def parse_wiki_articles(self, response):
+        """Multi-title version of `parse_wiki_article_prof`: routes each page back to instructors who wait for it"""
+        articles = response.meta['articles']
+        json_response = json.loads(response.text)
+        query = json_response.get('query', {})
+
+        # requested title -> title of the returned page
+        renamed = {r['from']: r['to'] for r in query.get('normalized', [])}
+        redirects = {r['from']: r['to'] for r in query.get('redirects', [])}
+        pages = {page['title']: page for page in query.get('pages', {}).values()}
+
+        items = []
+        rows = []
+        requests = []
+        for title, contexts in articles.items():
+            page_title = renamed.get(title, title)
+            page_title = redirects.get(page_title, page_title)
+            page = pages.get(page_title)
+            if page is None or 'missing' in page:
+                logger.debug('WIKI: Article not found: %s', title)
+                continue
+            if 'extract' not in page:
+                if 'continue' not in json_response:
+                    continue
+                # didn't fit into this response, fetch again
+                for context in contexts:
+                    request = self._queue_article(title, context['instructor'], context['department'])
+                    if request is not None:
+                        requests.append(request)
+                continue
+            for context in contexts:
+                item = WikipediaInstructorPotentialArticle(
+                    name=context['instructor'],
+                    department=context['department'],
+                    wikipedia_title=page['title'],
+                    wikipedia_raw_page=page['extract'],
+                    intro_only=True)
+                items.append(item)
+                rows.append(item.to_dict())
+
+        def _on_predicted(pred):
+            for p, item in zip(pred, items):
+                # saving potential articles is useful for training the classifier later
+                yield item
+                if p == self.article_clf.LABEL_RELEVANT:
+                    yield WikipediaInstructorArticle(
+                        name=item['name'],
+                        department=item['department'],
+                        wikipedia_title=item['wikipedia_title'])
+        if len(rows) == 0:
+            return requests
+        return requests + list(_on_predicted(await self._classify(self.article_clf, 'wiki_article_', rows)))
 
     # load the entire article from wikipedia
-    def parse_wiki_article_prof(self, response):
+    async def parse_wiki_article_prof(self, response):
         """ Starting with department list, crawl all listings by each department.
 
         @url https://en.wikipedia.org/w/api.php?format=json&action=query&prop=extracts&exlimit=max&explaintext&titles=Caroline+Pafford+Miller&redirects=> (referer: https://en.wikipedia.org/w/api.php?action=query&list=search&utf8=&format=json&srsearch=Columbia+University+intitle%3ACaroline+Miller
@@ -162,14 +306,15 @@ class WikiSearchSpider(scrapy.Spider):
             name=instructor,
             department=department,
             wikipedia_title=page['title'],
-            wikipedia_raw_page=page['extract'])
-        yield item
+            wikipedia_raw_page=page['extract'],
+            intro_only=False)
 
         # predict/classify if article is related to instructor
-        rows = [item.to_dict()]
-        pred = self.article_clf.predict(rows)
-        if pred[0] == WikiArticleClassifier.LABEL_RELEVANT:
-            yield WikipediaInstructorArticle(
-                name=instructor,
-                department=department,
-                wikipedia_title=page['title'])
+        def _on_predicted(pred):
+            yield item
+            if pred[0] == self.article_clf.LABEL_RELEVANT:
+                yield WikipediaInstructorArticle(
+                    name=instructor,
+                    department=department,
+                    wikipedia_title=page['title'])
+        return list(_on_predicted(await self._classify(self.article_clf, 'wiki_article_', [item.to_dict()])))
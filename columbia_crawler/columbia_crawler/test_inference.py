@@ -0,0 +1,31 @@
+import numpy as np
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from columbia_crawler.inference import BatchInferenceService
+
+
+class FakeClassifier:
+    label_class_weights = [1.0, 1.0]
+
+    def __init__(self):
+        self.batches = []
+
+    def predict_proba_batch(self, rows, batch_size=32):
+        self.batches.append(len(rows))
+        return np.array([[1.0 - r, r] for r in rows])
+
+
+class TestBatchInferenceService(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_batching(self):
+        clf = FakeClassifier()
+        service = BatchInferenceService(clf, max_batch_size=4, max_delay=0.01)
+        d1 = service.predict([0, 1])
+        d2 = service.predict([1])
+        d3 = service.predict([])
+        d4 = service.predict([0, 0, 1])
+        results = yield defer.gatherResults([d1, d2, d3, d4])
+        self.assertEqual([[0, 1], [1], [], [0, 0, 1]], [list(r) for r in results])
+        # rows of all requests went to the model at once when the batch filled up
+        self.assertEqual([6], clf.batches)
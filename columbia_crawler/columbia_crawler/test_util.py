@@ -0,0 +1,119 @@
+import os
+import shutil
+from unittest import TestCase
+
+import pandas as pd
+
+from columbia_crawler.util import InstructorsInternalDb, InstructorsInternalSqliteDb
+from cu_catalog import config
+
+
+class TestInstructorsInternalDb(TestCase):
+    def setUp(self):
+        shutil.rmtree(config.DATA_INTERNAL_DB_DIR, ignore_errors=True)
+
+    def test_journal_replay(self):
+        db = InstructorsInternalDb(['last_wikipedia_search'])
+        db.update_instructor('test instructor 1', 'last_wikipedia_search')
+        db.update_instructor('test instructor 2', 'last_wikipedia_search')
+        db.checkpoint()
+        self.assertFalse(os.path.exists(config.DATA_INSTRUCTORS_INTERNAL_INFO_JSON))
+
+        # simulate crash: nothing stored but the journal
+        db2 = InstructorsInternalDb(['last_wikipedia_search', 'last_culpa_profile'])
+        self.assertEqual(2, db2.journal_updates)
+        self.assertEqual(['test instructor 1', 'test instructor 2'], sorted(db2.df_internal['name']))
+        self.assertTrue(db2.df_internal['last_wikipedia_search'].notna().all())
+        self.assertFalse(db2.check_its_time('test instructor 1', 'last_wikipedia_search', 1, 2))
+
+    def test_compaction(self):
+        db = InstructorsInternalDb(['last_culpa_profile'])
+        db.update_instructor('test instructor 1', 'last_culpa_profile')
+        db.store()
+        self.assertFalse(os.path.exists(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL))
+
+        # journaled update of one field keeps other fields from the main file
+        db = InstructorsInternalDb(['last_wikipedia_search'])
+        db.update_instructor('test instructor 1', 'last_wikipedia_search')
+        with open(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL, 'a') as f:
+            f.write('{"name": "broken')
+
+        db = InstructorsInternalDb(['last_wikipedia_search', 'last_culpa_profile'])
+        self.assertEqual(1, len(db.df_internal))
+        row = db.df_internal.iloc[0]
+        self.assertTrue(pd.notna(row['last_wikipedia_search']))
+        self.assertTrue(pd.notna(row['last_culpa_profile']))
+
+    def test_concurrent_compaction(self):
+        db = InstructorsInternalDb(['last_wikipedia_search'])
+        db2 = InstructorsInternalDb(['last_culpa_profile'])
+        db.update_instructor('test instructor 1', 'last_wikipedia_search')
+        db2.update_instructor('test instructor 2', 'last_culpa_profile')
+
+        # compaction by one writer keeps updates journaled by the other one
+        db.store()
+        db2.update_instructor('test instructor 3', 'last_culpa_profile')
+        db2.checkpoint()
+        self.assertTrue(os.path.exists(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL))
+
+        db = InstructorsInternalDb(['last_wikipedia_search', 'last_culpa_profile'])
+        self.assertEqual(['test instructor 1', 'test instructor 2', 'test instructor 3'], sorted(db.df_internal['name']))
+        self.assertFalse(db.check_its_time('test instructor 1', 'last_wikipedia_search', 1, 2))
+        self.assertFalse(db.check_its_time('test instructor 2', 'last_culpa_profile', 1, 2))
+        self.assertFalse(db.check_its_time('test instructor 3', 'last_culpa_profile', 1, 2))
+
+        # and compaction by the other one keeps what the first one stored
+        db2.store()
+        db = InstructorsInternalDb(['last_wikipedia_search', 'last_culpa_profile'])
+        self.assertEqual(0, db.journal_updates)
+        self.assertFalse(db.check_its_time('test instructor 1', 'last_wikipedia_search', 1, 2))
+        self.assertFalse(db.check_its_time('test instructor 3', 'last_culpa_profile', 1, 2))
+
+    def test_close(self):
+        with InstructorsInternalDb(['last_wikipedia_search']) as db:
+            db.update_instructor('test instructor 1', 'last_wikipedia_search')
+            self.assertIsNotNone(db.journal_file)
+        self.assertIsNone(db.journal_file)
+        self.assertIsNone(db.lock_file)
+        self.assertEqual(1, InstructorsInternalDb(['last_wikipedia_search']).journal_updates)
+
+        # compaction releases files too, next updates open them again
+        db.store()
+        self.assertIsNone(db.lock_file)
+        db.update_instructor('test instructor 2', 'last_wikipedia_search')
+        db.close()
+        db = InstructorsInternalDb(['last_wikipedia_search'])
+        self.assertEqual(1, db.journal_updates)
+        self.assertEqual(2, len(db.df_internal))
+
+    def test_due_instructors(self):
+        db = InstructorsInternalDb(['last_wikipedia_search'])
+        db.update_instructor('test instructor 1', 'last_wikipedia_search')
+        due = db.due_instructors(['test instructor 1', 'test instructor 2'], 'last_wikipedia_search', 3, 7)
+        self.assertEqual(['test instructor 2'], due)
+
+
+class TestInstructorsInternalSqliteDb(TestCase):
+    def setUp(self):
+        shutil.rmtree(config.DATA_INTERNAL_DB_DIR, ignore_errors=True)
+
+    def test_import_json(self):
+        db = InstructorsInternalDb(['last_culpa_profile'])
+        db.update_instructor('test instructor 1', 'last_culpa_profile')
+        db.store()
+
+        db = InstructorsInternalSqliteDb(['last_culpa_profile', 'last_wikipedia_search'])
+        self.assertEqual(['test instructor 1'], list(db.df_internal['name']))
+        self.assertFalse(db.check_its_time('test instructor 1', 'last_culpa_profile', 3, 7))
+        self.assertTrue(db.check_its_time('test instructor 1', 'last_wikipedia_search', 3, 7))
+
+    def test_due_instructors(self):
+        db = InstructorsInternalSqliteDb(['last_wikipedia_search'])
+        db.update_instructor('test instructor 1', 'last_wikipedia_search')
+
+        # second connection to the same file sees committed updates
+        db2 = InstructorsInternalSqliteDb(['last_wikipedia_search'])
+        db2.update_instructor('test instructor 3', 'last_wikipedia_search')
+        names = ['test instructor 1', 'test instructor 2', 'test instructor 3']
+        self.assertEqual(['test instructor 2'], db.due_instructors(names, 'last_wikipedia_search', 15, 45))
+        self.assertEqual(names, sorted(db.due_instructors(names, 'last_wikipedia_search', -2, -1)))
@@ -1,13 +1,21 @@
+import contextlib
 import datetime
+import fcntl
+import json
+import logging
 import os
 import random
 import re
+import sqlite3
 import scrapy
 from typing import List, Iterable
+import numpy as np
 import pandas as pd
 
 from cu_catalog import config
 
+logger = logging.getLogger(__name__)
+
 
 def split_term(term_str):
     search = re.search('(\w+)(\d{4})', term_str, re.IGNORECASE)
@@ -44,9 +52,19 @@ def spider_run_loop(spider: scrapy.Spider, iterator: Iterable, _yield_func):
 
 
 class InstructorsInternalDb:
+    """Keeps track of when instructors were last checked by spiders.
+
+    Every update is appended to a journal file right away, so a crash loses at most
+    the last line. The journal is replayed on load and compacted into the main file
+    by `store()` or once it grows larger than the table. Several instances (spiders running
+    in parallel) may share the files: a file lock keeps appends out of a compaction in progress.
+    """
     def __init__(self, datetime_fields: List[str]):
         self.df_internal = InstructorsInternalDb._load_internal_instructors_db(datetime_fields)
         self.datetime_fields = datetime_fields
+        self.journal_updates = self._replay_journal()
+        self.journal_file = None
+        self.lock_file = None
 
     @staticmethod
     def _load_internal_instructors_db(datetime_fields: List[str]):
@@ -66,12 +84,91 @@ class InstructorsInternalDb:
             cols.extend(datetime_fields)
             return pd.DataFrame(columns=cols)
 
+    def _replay_journal(self) -> int:
+        """Applies journaled updates on top of the loaded table. Returns number of journal lines."""
+        if not os.path.exists(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL):
+            return 0
+        updates = []
+        with open(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL, 'r') as f:
+            for line in f:
+                try:
+                    updates.append(json.loads(line))
+                except ValueError:
+                    # the last line may be cut off by a crash
+                    logger.warning("Skipping broken line in internal db journal: %s", line)
+        if len(updates) == 0:
+            return 0
+
+        # keep only the latest timestamp per instructor and field
+        df_updates = pd.DataFrame(updates) \
+            .pivot_table(index='name', columns='field', values='ts', aggfunc='max')
+        self._merge_latest(df_updates)
+        logger.info("Replayed %s updates from internal db journal", len(updates))
+        return len(updates)
+
+    def _merge_latest(self, df_updates: pd.DataFrame):
+        """Merges a table indexed by name into the loaded one, the latest timestamp of each field wins"""
+        df = self.df_internal.drop_duplicates('name').set_index('name')
+        for field in df_updates.columns:
+            if field not in df.columns:
+                df[field] = pd.NaT
+            df[field] = pd.to_datetime(df[field], unit='ms')
+        df = df.reindex(df.index.union(df_updates.index))
+        for field in df_updates.columns:
+            other = pd.to_datetime(df_updates[field], unit='ms').reindex(df.index)
+            df[field] = other.where(other.notna() & ~(other < df[field]), df[field])
+        self.df_internal = df.rename_axis('name').reset_index()
+
     def update_instructor(self, name: str, field: str):
         assert field in self.datetime_fields
         if name not in self.df_internal['name'].values:
             new_row = pd.DataFrame([{'name': name}])
             self.df_internal = pd.concat([self.df_internal, new_row], ignore_index=True)
-        self.df_internal.loc[self.df_internal['name'] == name, field] = datetime.datetime.now()
+        now = datetime.datetime.now()
+        self.df_internal.loc[self.df_internal['name'] == name, field] = now
+        self._journal(name, field, now)
+
+    @contextlib.contextmanager
+    def _locked(self, operation: int):
+        """File lock shared by all instances and processes using the journal:
+        appends take it shared, compaction exclusive, so no append goes to a journal being removed."""
+        if self.lock_file is None:
+            os.makedirs(config.DATA_INTERNAL_DB_DIR, exist_ok=True)
+            self.lock_file = open(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL + '.lock', 'a')
+        fcntl.flock(self.lock_file.fileno(), operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _journal_replaced(self) -> bool:
+        """Whether another writer compacted the journal since we opened it"""
+        try:
+            return os.stat(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL).st_ino \
+                != os.fstat(self.journal_file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _journal(self, name: str, field: str, dt: datetime.datetime):
+        # same epoch milliseconds as pandas uses for the main file
+        ts = pd.Timestamp(dt).value // 10 ** 6
+        with self._locked(fcntl.LOCK_SH):
+            if self.journal_file is not None and self._journal_replaced():
+                self.journal_file.close()
+                self.journal_file = None
+            if self.journal_file is None:
+                self.journal_file = open(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL, 'a')
+            self.journal_file.write(json.dumps({'name': name, 'field': field, 'ts': ts}) + '\n')
+            self.journal_file.flush()
+        self.journal_updates += 1
+        if self.journal_updates >= max(config.INTERNAL_DB_COMPACT_MIN_UPDATES, len(self.df_internal)):
+            self.store()
+
+    def checkpoint(self):
+        """Makes sure all journaled updates are on disk. Cheap, can be called often."""
+        if self.journal_file is not None:
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
 
     def check_its_time(self, name: str, field: str, days_min: int, days_max: int):
         if name not in self.df_internal['name'].values:
@@ -79,14 +176,161 @@ class InstructorsInternalDb:
         dt = self.df_internal.loc[self.df_internal['name'] == name, field].iloc[0]
         return InstructorsInternalDb.recent_threshold(dt, days_min, days_max)
 
+    def due_instructors(self, names: Iterable[str], field: str, days_min: int, days_max: int) -> List[str]:
+        """Selects instructors from `names` which were not checked for `field` recently.
+        As in `recent_threshold`, the threshold is rolled between days_min and days_max for every instructor."""
+        names = list(names)
+        last = self.df_internal.drop_duplicates('name').set_index('name')[field].reindex(names)
+        last = pd.to_datetime(last)
+        days = np.random.randint(days_min, days_max + 1, size=len(names))
+        threshold = pd.Timestamp(datetime.datetime.now()) - pd.to_timedelta(days, unit='D')
+        due = last.isna().values | (last.values < threshold.values)
+        return [name for name, is_due in zip(names, due) if is_due]
+
     def store(self):
-        os.makedirs(config.DATA_INTERNAL_DB_DIR, exist_ok=True)
-        with open(config.DATA_INSTRUCTORS_INTERNAL_INFO_JSON, 'w') as file_json:
-            self.df_internal.sort_values(by=['name'], inplace=True)
-            self.df_internal.to_json(path_or_buf=file_json, orient="records", lines=True)
+        """Writes the entire table and truncates the journal (compaction).
+        Updates of other writers, stored or journaled, are merged in first so none of them is lost."""
+        with self._locked(fcntl.LOCK_EX):
+            df_stored = InstructorsInternalDb._load_internal_instructors_db(self.datetime_fields)
+            self._merge_latest(df_stored.drop_duplicates('name').set_index('name'))
+            self._replay_journal()
+
+            tmp_filename = config.DATA_INSTRUCTORS_INTERNAL_INFO_JSON + '.tmp'
+            with open(tmp_filename, 'w') as file_json:
+                self.df_internal.sort_values(by=['name'], inplace=True)
+                self.df_internal.to_json(path_or_buf=file_json, orient="records", lines=True)
+            os.replace(tmp_filename, config.DATA_INSTRUCTORS_INTERNAL_INFO_JSON)
+
+            if self.journal_file is not None:
+                self.journal_file.close()
+                self.journal_file = None
+            if os.path.exists(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL):
+                os.remove(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL)
+        self.journal_updates = 0
+        self.close()
+
+    def close(self):
+        """Flushes the journal and closes files. They are opened again on the next update"""
+        if self.journal_file is not None:
+            self.checkpoint()
+            self.journal_file.close()
+            self.journal_file = None
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     @staticmethod
     def recent_threshold(x, days_min: int, days_max: int):
         if pd.isna(x):
             return True
         return x < datetime.datetime.now() - datetime.timedelta(days=random.randint(days_min, days_max))
+
+
+class InstructorsInternalSqliteDb:
+    """SQLite version of `InstructorsInternalDb` with the same interface.
+
+    Timestamps are kept in a narrow (name, field, ts) table indexed by field and time,
+    so "who is due for source X" is a single query. Every update is committed right away
+    and WAL mode lets several spiders write to the same file concurrently.
+    """
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS instructor_checks ('
+        '  name TEXT NOT NULL, field TEXT NOT NULL, ts INTEGER NOT NULL, PRIMARY KEY (name, field))',
+        'CREATE INDEX IF NOT EXISTS instructor_checks_field_ts ON instructor_checks (field, ts)',
+    ]
+
+    def __init__(self, datetime_fields: List[str], filename: str = None):
+        assert 'name' not in datetime_fields
+        self.datetime_fields = datetime_fields
+        self.filename = filename or config.DATA_INSTRUCTORS_INTERNAL_INFO_SQLITE
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.conn = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        for stmt in InstructorsInternalSqliteDb.SCHEMA:
+            self.conn.execute(stmt)
+        self._import_json()
+
+    def _import_json(self):
+        """Moves data from the json database on first use"""
+        if self.conn.execute('SELECT 1 FROM instructor_checks LIMIT 1').fetchone() is not None:
+            return
+        if not os.path.exists(config.DATA_INSTRUCTORS_INTERNAL_INFO_JSON) \
+                and not os.path.exists(config.DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL):
+            return
+        df = InstructorsInternalDb([]).df_internal.set_index('name')
+        rows = []
+        for field in df.columns:
+            values = pd.to_datetime(df[field], unit='ms').dropna()
+            rows.extend((name, field, ts.value // 10 ** 6) for name, ts in values.items())
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany('INSERT OR IGNORE INTO instructor_checks (name, field, ts) VALUES (?, ?, ?)', rows)
+        logger.info("Imported %s timestamps from %s", len(rows), config.DATA_INSTRUCTORS_INTERNAL_INFO_JSON)
+
+    @property
+    def df_internal(self) -> pd.DataFrame:
+        df = pd.read_sql_query('SELECT name, field, ts FROM instructor_checks', self.conn)
+        df = df.pivot(index='name', columns='field', values='ts')
+        for field in self.datetime_fields:
+            if field not in df.columns:
+                df[field] = np.nan
+        for field in df.columns:
+            df[field] = pd.to_datetime(df[field], unit='ms')
+        return df.rename_axis(None, axis=1).rename_axis('name').reset_index()
+
+    def update_instructor(self, name: str, field: str):
+        assert field in self.datetime_fields
+        ts = pd.Timestamp(datetime.datetime.now()).value // 10 ** 6
+        self.conn.execute('INSERT INTO instructor_checks (name, field, ts) VALUES (?, ?, ?) '
+                          'ON CONFLICT (name, field) DO UPDATE SET ts = excluded.ts', (name, field, ts))
+
+    def check_its_time(self, name: str, field: str, days_min: int, days_max: int):
+        row = self.conn.execute('SELECT ts FROM instructor_checks WHERE name = ? AND field = ?',
+                                (name, field)).fetchone()
+        if row is None:
+            return True
+        return InstructorsInternalDb.recent_threshold(pd.to_datetime(row[0], unit='ms'), days_min, days_max)
+
+    def due_instructors(self, names: Iterable[str], field: str, days_min: int, days_max: int) -> List[str]:
+        """Same as `InstructorsInternalDb.due_instructors`"""
+        now = pd.Timestamp(datetime.datetime.now()).value // 10 ** 6
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS candidates (name TEXT PRIMARY KEY)')
+            self.conn.execute('DELETE FROM candidates')
+            self.conn.executemany('INSERT OR IGNORE INTO candidates (name) VALUES (?)', ((n,) for n in names))
+            rows = self.conn.execute(
+                'SELECT c.name FROM candidates c '
+                'LEFT JOIN instructor_checks i ON i.name = c.name AND i.field = ? '
+                'WHERE i.ts IS NULL OR i.ts < ? - (? + abs(random()) % ?) * 86400000',
+                (field, now, days_min, days_max - days_min + 1)).fetchall()
+        return [r[0] for r in rows]
+
+    def checkpoint(self):
+        pass  # every update is already committed
+
+    def store(self):
+        self.conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_instructors_internal_db(datetime_fields: List[str]):
+    """Opens internal db with the backend set in config"""
+    if config.INTERNAL_DB_BACKEND == 'sqlite':
+        return InstructorsInternalSqliteDb(datetime_fields)
+    return InstructorsInternalDb(datetime_fields)
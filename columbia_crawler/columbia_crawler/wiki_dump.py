@@ -0,0 +1,164 @@
+import bz2
+import gzip
+import logging
+import re
+import sqlite3
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class WikiDumpIndex:
+    """Local title and first paragraph index of Wikipedia built from an abstracts dump
+    (https://dumps.wikimedia.org/enwiki/latest/enwiki-latest-abstract.xml.gz).
+
+    Answers the search and extracts queries of WikiSearchSpider with the same json as api.php,
+    see `api_query()`. Differences from the live API: only lead paragraphs are indexed, so text terms
+    outside of `intitle:` rank results instead of filtering them, and redirects are not resolved.
+
+    >>> import tempfile
+    >>> fn = tempfile.mkdtemp() + '/abstract.xml'
+    >>> with open(fn, 'w') as f:
+    ...     _ = f.write('''<feed>
+    ... <doc><title>Wikipedia: Jane Roe</title><url>u</url><abstract>Jane Roe is a professor at Columbia University.</abstract></doc>
+    ... <doc><title>Wikipedia: Jane Roe (singer)</title><url>u</url><abstract>Jane Roe is a singer.</abstract></doc>
+    ... <doc><title>Wikipedia: John Doe</title><url>u</url><abstract>John Doe is a chemist.</abstract></doc>
+    ... </feed>''')
+    >>> index = WikiDumpIndex(fn + '.sqlite')
+    >>> index.build(fn)
+    3
+    >>> [r['title'] for r in index.search('Columbia University intitle:Jane Roe')]
+    ['Jane Roe', 'Jane Roe (singer)']
+    >>> index.search('Columbia University intitle:Jane Roe')[0]['snippet']
+    '<span class="searchmatch">Jane</span> <span class="searchmatch">Roe</span> is a professor at <span class="searchmatch">Columbia</span> <span class="searchmatch">University</span>.'
+    >>> q = index.extracts(['john_Doe', 'Nobody'])
+    >>> q['normalized'], [(p['title'], p.get('extract')) for p in q['pages'].values()]
+    ([{'from': 'john_Doe', 'to': 'John Doe'}], [('John Doe', 'John Doe is a chemist.'), ('Nobody', None)])
+    """
+    TITLE_PREFIX = 'Wikipedia: '
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS pages '
+                              '(pageid INTEGER PRIMARY KEY, title TEXT UNIQUE NOT NULL, abstract TEXT)')
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5"
+                              "(title, abstract, content='pages', content_rowid='pageid', "
+                              "tokenize='unicode61 remove_diacritics 2')")
+
+    @staticmethod
+    def _open(filename: str):
+        if filename.endswith('.gz'):
+            return gzip.open(filename, 'rb')
+        if filename.endswith('.bz2'):
+            return bz2.open(filename, 'rb')
+        return open(filename, 'rb')
+
+    def _read_dump(self, dump_filename: str) -> Iterable[Tuple[str, str]]:
+        with self._open(dump_filename) as f:
+            root = None
+            for event, elem in ET.iterparse(f, events=('start', 'end')):
+                if root is None:
+                    root = elem
+                if event != 'end' or elem.tag != 'doc':
+                    continue
+                title = elem.findtext('title') or ''
+                if title.startswith(self.TITLE_PREFIX):
+                    title = title[len(self.TITLE_PREFIX):]
+                abstract = elem.findtext('abstract') or ''
+                # processed docs stay attached to the root otherwise and the whole dump ends up in memory
+                root.clear()
+                if title:
+                    yield title, abstract
+
+    def build(self, dump_filename: str, batch_size: int = 10000) -> int:
+        """(Re)builds index from the abstracts dump, returns number of indexed pages"""
+        with self.conn:
+            self.conn.execute('DELETE FROM pages')
+            self.conn.execute("INSERT INTO pages_fts(pages_fts) VALUES ('delete-all')")
+        count = 0
+        batch = []
+
+        def _flush():
+            with self.conn:
+                self.conn.executemany('INSERT OR IGNORE INTO pages (title, abstract) VALUES (?, ?)', batch)
+            batch.clear()
+
+        for page in self._read_dump(dump_filename):
+            batch.append(page)
+            count += 1
+            if len(batch) >= batch_size:
+                _flush()
+                logger.info("Indexed %s pages", count)
+        _flush()
+        with self.conn:
+            self.conn.execute("INSERT INTO pages_fts(pages_fts) VALUES ('rebuild')")
+            self.conn.execute("INSERT INTO pages_fts(pages_fts) VALUES ('optimize')")
+        return count
+
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        return re.findall(r'\w+', text)
+
+    @staticmethod
+    def _highlight(text: str, terms: List[str]) -> str:
+        if len(terms) == 0:
+            return text
+        pattern = re.compile(r'\b(' + '|'.join(re.escape(t) for t in terms) + r')\b', re.IGNORECASE)
+        return pattern.sub(r'<span class="searchmatch">\1</span>', text)
+
+    def search(self, srsearch: str, limit: int = 10) -> List[Dict]:
+        """Search results for queries like 'Columbia University intitle:Jane Roe': all `intitle:` terms
+        must be in the title, pages mentioning the other terms in the first paragraph go first."""
+        m = re.match(r'(.*?)intitle:(.*)', srsearch)
+        text, title = (m.group(1), m.group(2)) if m else ('', srsearch)
+        title_terms = self._terms(title)
+        text_terms = self._terms(text)
+        if len(title_terms) == 0:
+            return []
+
+        match = 'title : (' + ' AND '.join('"%s"' % t for t in title_terms) + ')'
+        # pages mentioning all text terms first, then by relevance of title
+        text_order = ' + '.join(['(instr(lower(p.abstract), ?) > 0)'] * len(text_terms)) or '0'
+        rows = self.conn.execute(
+            'SELECT p.pageid, p.title, p.abstract FROM pages_fts f JOIN pages p ON p.pageid = f.rowid '
+            f'WHERE pages_fts MATCH ? ORDER BY ({text_order}) DESC, bm25(pages_fts) LIMIT ?',
+            [match] + [t.lower() for t in text_terms] + [limit]).fetchall()
+        return [{'ns': 0,
+                 'title': title,
+                 'pageid': pageid,
+                 'snippet': self._highlight(abstract, title_terms + text_terms)}
+                for pageid, title, abstract in rows]
+
+    @staticmethod
+    def normalize_title(title: str) -> str:
+        title = re.sub(r'\s+', ' ', title.replace('_', ' ')).strip()
+        return title[:1].upper() + title[1:]
+
+    def extracts(self, titles: List[str]) -> Dict:
+        """`query` part of api.php prop=extracts response for the titles"""
+        query = {'pages': {}}
+        normalized = [{'from': t, 'to': self.normalize_title(t)} for t in titles if self.normalize_title(t) != t]
+        if len(normalized) > 0:
+            query['normalized'] = normalized
+        missing = 0
+        for title in dict.fromkeys(self.normalize_title(t) for t in titles):
+            row = self.conn.execute('SELECT pageid, abstract FROM pages WHERE title = ?', (title,)).fetchone()
+            if row is None:
+                missing -= 1
+                query['pages'][str(missing)] = {'ns': 0, 'title': title, 'missing': ''}
+            else:
+                query['pages'][str(row[0])] = {'pageid': row[0], 'ns': 0, 'title': title, 'extract': row[1]}
+        return query
+
+    def api_query(self, params: Dict[str, str]) -> Dict:
+        """Response of api.php action=query for parameters of search and extracts requests"""
+        if params.get('list') == 'search':
+            search = self.search(params.get('srsearch', ''), int(params.get('srlimit', 10)))
+            return {'batchcomplete': '', 'query': {'searchinfo': {'totalhits': len(search)}, 'search': search}}
+        if params.get('prop') == 'extracts':
+            titles = [t for t in params.get('titles', '').split('|') if t]
+            return {'batchcomplete': '', 'query': self.extracts(titles)}
+        raise ValueError("Unsupported wikipedia query: %s" % params)
@@ -74,20 +74,68 @@ DATA_WIKI_ARTICLE_TRAIN_FILENAME = config['DATA_WIKI_ARTICLE_TRAIN_FILENAME']
 DATA_WIKI_ARTICLE_MODEL_FILENAME = config['DATA_WIKI_ARTICLE_MODEL_FILENAME']
 DATA_WIKI_ARTICLE_MODEL_CHECKPOINTS = config['DATA_WIKI_ARTICLE_MODEL_CHECKPOINTS']
 
+# tokenized training data
+DATA_WIKI_TOKENIZED_CACHE_DIR = config['DATA_WIKI_TOKENIZED_CACHE_DIR']
+
+# local index of Wikipedia abstracts dump answering wiki spider API requests (empty - use live API)
+WIKI_DUMP_INDEX = config['WIKI_DUMP_INDEX']
+# articles fetched per Wikipedia API query (1 - one full article per query)
+WIKI_ARTICLE_BATCH_SIZE = config.getint('WIKI_ARTICLE_BATCH_SIZE')
+# skip search results sharing no name parts with instructor without running the classifier
+WIKI_PREFILTER_ENABLED = config.getboolean('WIKI_PREFILTER_ENABLED')
+# load INT8 quantized variants of classifiers (see scripts/wiki_quantize.py)
+MODEL_QUANTIZED = config.getboolean('MODEL_QUANTIZED')
+# on-disk cache of classifier predictions, emptied when model files change
+PREDICTION_CACHE_ENABLED = config.getboolean('PREDICTION_CACHE_ENABLED')
+PREDICTION_CACHE_MAX_ENTRIES = config.getint('PREDICTION_CACHE_MAX_ENTRIES')
+# threads used by torch for inference on CPU (0 - torch default)
+TORCH_NUM_THREADS = config.getint('TORCH_NUM_THREADS')
+
+# batched inference in wiki spider (batch size 1 disables it)
+WIKI_INFERENCE_BATCH_SIZE = config.getint('WIKI_INFERENCE_BATCH_SIZE')
+WIKI_INFERENCE_MAX_DELAY = config.getfloat('WIKI_INFERENCE_MAX_DELAY')
+
 # scraped classes data files
 DATA_CLASSES_DIR = config['DATA_CLASSES_DIR']
 DATA_CLASSES_ENROLLMENT_DIR = config['DATA_CLASSES_ENROLLMENT_DIR']
 DATA_INSTRUCTORS_DIR = config['DATA_INSTRUCTORS_DIR']
 DATA_INSTRUCTORS_JSON = DATA_INSTRUCTORS_DIR + '/instructors.json'
+# CULPA professor name -> profile link from culpa.info/browse_by_prof
+DATA_CULPA_PROFS_JSON = DATA_INSTRUCTORS_DIR + '/culpa-profs.json'
+# CULPA reviews, one jsonl file per CULPA professor id (referenced by instructor's culpa_link)
+DATA_CULPA_REVIEWS_DIR = DATA_INSTRUCTORS_DIR + '/culpa-reviews'
 DATA_INSTRUCTORS_CSV = DATA_INSTRUCTORS_DIR + '/instructors.csv'
 
 # Google scholar
 DATA_GSCHOLAR_DIR = config['DATA_GSCHOLAR_DIR']
 DATA_GSCHOLAR_UNSURE_FILENAME = config['DATA_GSCHOLAR_UNSURE_FILENAME']
+# instructors changed since the last full store (merged at the end of run or replayed after a crash)
+DATA_GSCHOLAR_DELTA_LOG = DATA_GSCHOLAR_DIR + '/instructors-delta.jsonl'
+SCHOLAR_MAX_PROCESS = config.getint('SCHOLAR_MAX_PROCESS')
+SCHOLAR_WORKERS = config.getint('SCHOLAR_WORKERS')
+# global request rate limit (token bucket)
+SCHOLAR_REQUESTS_PER_MINUTE = config.getfloat('SCHOLAR_REQUESTS_PER_MINUTE')
+SCHOLAR_REQUESTS_BURST = config.getint('SCHOLAR_REQUESTS_BURST')
+SCHOLAR_PROXIES = [p.strip() for p in config['SCHOLAR_PROXIES'].split(',') if p.strip()]
+SCHOLAR_MAX_BLOCKS_IN_ROW = config.getint('SCHOLAR_MAX_BLOCKS_IN_ROW')
 
 # internal database for keeping track e.g. when instructor was last searched in wikipedia
 DATA_INTERNAL_DB_DIR = config['DATA_INTERNAL_DB_DIR']
 DATA_INSTRUCTORS_INTERNAL_INFO_JSON = config['DATA_INTERNAL_DB_DIR'] + "/instructors-internal.json"
+# append-only log of updates since the last full write of DATA_INSTRUCTORS_INTERNAL_INFO_JSON
+DATA_INSTRUCTORS_INTERNAL_INFO_JOURNAL = config['DATA_INTERNAL_DB_DIR'] + "/instructors-internal.journal.jsonl"
+INTERNAL_DB_COMPACT_MIN_UPDATES = config.getint('INTERNAL_DB_COMPACT_MIN_UPDATES')
+# json or sqlite
+INTERNAL_DB_BACKEND = config['INTERNAL_DB_BACKEND']
+DATA_INSTRUCTORS_INTERNAL_INFO_SQLITE = config['DATA_INTERNAL_DB_DIR'] + "/instructors-internal.sqlite"
+# remembered matches of names from external sources to catalog instructors
+DATA_ENTITY_RESOLUTION_DB = config['DATA_INTERNAL_DB_DIR'] + "/entity-resolution.sqlite"
+
+# max requests per run of enrichment spiders
+WIKI_DAILY_BUDGET = config.getint('WIKI_DAILY_BUDGET')
+CULPA_DAILY_BUDGET = config.getint('CULPA_DAILY_BUDGET')
+# parse and merge only new CULPA reviews
+CULPA_INCREMENTAL_REVIEWS = config.getboolean('CULPA_INCREMENTAL_REVIEWS')
 
 # unit tests related data
 TEST_DATA_DIR = dirname(dirname(abspath(__file__))) + "/test-data"
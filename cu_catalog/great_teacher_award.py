@@ -7,11 +7,13 @@ import pandas as pd
 import requests
 
 import models.cudata as cudata
-from cu_catalog.models.util import words_match2
+from cu_catalog import config
+from cu_catalog.models.entity_resolution import EntityResolver
 
 url = "https://www.socgtoday.com/masterrecipientlist"
 
 instructors = cudata.load_instructors()
+entity_resolver = EntityResolver(config.DATA_ENTITY_RESOLUTION_DB, instructors.keys())
 
 r = requests.get(url)
 data = r.text
@@ -20,11 +22,7 @@ soup = BeautifulSoup(data, features="lxml")
 
 
 def match_name(gta_name) -> List[str]:
-    result = []
-    for name in instructors.keys():
-        if words_match2(name, gta_name):
-            result.append(name)
-    return result
+    return entity_resolver.resolve('gta', gta_name)
 
 
 for h3 in soup.select('h3'):
@@ -19,6 +19,62 @@ def load_instructors():
     return instructors
 
 
+class InstructorsDeltaLog:
+    """Append-only log of changed instructor fields, a cheap checkpoint between full `store_instructors()`.
+    After a crash, `replay()` applies logged changes to freshly loaded instructors.
+
+    >>> import tempfile
+    >>> fn = tempfile.mkdtemp() + '/delta.jsonl'
+    >>> log = InstructorsDeltaLog(fn)
+    >>> log.append('Jane Roe', {'gscholar': {'scholar_id': 'x'}})
+    >>> log.append('Jane Roe', {'gscholar': {'scholar_id': 'y'}})
+    >>> log.checkpoint()
+    >>> instructors = {'Jane Roe': {'name': 'Jane Roe', 'gscholar': None}}
+    >>> InstructorsDeltaLog(fn).replay(instructors), instructors['Jane Roe']['gscholar']
+    (2, {'scholar_id': 'y'})
+    >>> log.clear(); InstructorsDeltaLog(fn).replay(instructors)
+    0
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.file = None
+
+    def append(self, name: str, fields: dict):
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            self.file = open(self.filename, 'a')
+        self.file.write(json.dumps({'name': name, 'fields': fields}) + '\n')
+
+    def checkpoint(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def replay(self, instructors) -> int:
+        """Applies logged changes of known instructors, returns number of applied changes"""
+        if not os.path.exists(self.filename):
+            return 0
+        count = 0
+        with open(self.filename, 'r') as f:
+            for line in f:
+                try:
+                    delta = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # last line was cut by crash
+                if delta['name'] in instructors:
+                    instructors[delta['name']].update(delta['fields'])
+                    count += 1
+        return count
+
+    def clear(self):
+        """Removes the log once changes are stored with `store_instructors()`"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
 def load_term(term):
     filename = config.DATA_CLASSES_DIR + '/' + term + '.json'
     if not os.path.exists(filename):
@@ -29,6 +85,7 @@ def load_term(term):
 
 def store_instructors(df_json):
     os.makedirs(config.DATA_INSTRUCTORS_DIR, exist_ok=True)
+    migrate_culpa_reviews(df_json)
     df_json.sort_values(by=['name'], inplace=True)
     df_json['departments'] = df_json['departments'] \
         .apply(to_sorted_list)
@@ -40,7 +97,7 @@ def store_instructors(df_json):
         .apply(lambda x: "\n".join(sorted(x)) if np.all(pd.notna(x)) else x)
     df_csv['classes'] = df_csv['classes'] \
         .apply(lambda x: ("\n".join([" ".join(sorted(cls)) for cls in x]) if np.all(pd.notna(x)) else x))
-    remove_columns = ['culpa_reviews', 'gscholar']  # remove some columns from csv but leave in json
+    remove_columns = ['gscholar']  # remove some columns from csv but leave in json
     for c in remove_columns:
         if c in df_csv.columns:
             df_csv = df_csv.drop([c], axis=1)
@@ -48,6 +105,45 @@ def store_instructors(df_json):
     store_df(config.DATA_INSTRUCTORS_DIR + '/instructors', df_json, df_csv)
 
 
+def culpa_reviews_filename(culpa_link: str) -> str:
+    """Reviews file of CULPA professor, named by CULPA id from the profile link
+
+    >>> culpa_reviews_filename('http://culpa.info/professors/3126')[-len('/culpa-reviews/3126.jsonl'):]
+    '/culpa-reviews/3126.jsonl'
+    """
+    culpa_id = culpa_link.rstrip('/').rsplit('/', 1)[-1]
+    return config.DATA_CULPA_REVIEWS_DIR + '/' + culpa_id + '.jsonl'
+
+
+def load_culpa_reviews(culpa_link: str) -> List[dict]:
+    """Stored reviews of CULPA professor, newest first"""
+    filename = culpa_reviews_filename(culpa_link)
+    if not os.path.exists(filename):
+        return []
+    with open(filename, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def store_culpa_reviews(culpa_link: str, reviews: List[dict]):
+    filename = culpa_reviews_filename(culpa_link)
+    os.makedirs(config.DATA_CULPA_REVIEWS_DIR, exist_ok=True)
+    with open(filename + '.tmp', 'w') as f:
+        for review in reviews:
+            f.write(json.dumps(review) + '\n')
+    os.replace(filename + '.tmp', filename)
+
+
+def migrate_culpa_reviews(df_json: pd.DataFrame):
+    """Moves reviews embedded in instructors data (culpa_reviews column) to reviews files"""
+    if 'culpa_reviews' not in df_json.columns:
+        return
+    for _, row in df_json[df_json['culpa_link'].notnull()].iterrows():
+        # files written since are newer than embedded reviews
+        if isinstance(row['culpa_reviews'], list) and not os.path.exists(culpa_reviews_filename(row['culpa_link'])):
+            store_culpa_reviews(row['culpa_link'], row['culpa_reviews'])
+    df_json.drop(columns=['culpa_reviews'], inplace=True)
+
+
 def store_df(filename: str, df_json: pd.DataFrame, df_csv: pd.DataFrame):
     # store json
     file_json = open(filename + '.json', 'w')
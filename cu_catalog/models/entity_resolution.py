@@ -0,0 +1,113 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from cu_catalog.models.util import NameIndex, words_match2
+
+
+class EntityResolver:
+    """Matches names from external sources (CULPA, Google Scholar, awards lists...) to catalog instructors
+    and remembers decisions per (source, external name) between runs.
+
+    Catalog names are candidates numbered in the order they were first seen. A decision records
+    the last candidate number it was checked against, so later runs only compare external names
+    with instructors added since. Decisions set with `set_decision()` are never re-matched.
+    Sources where different people share a display name (Google Scholar profiles) pass `external_id`
+    to keep decisions per profile, the name is still used for matching.
+
+    >>> import tempfile
+    >>> fn = tempfile.mkdtemp() + '/er.sqlite'
+    >>> resolver = EntityResolver(fn, ["Li, Zhi", "Dragomir Radev"])
+    >>> resolver.resolve('gta', "Zhi Li")
+    ['Li, Zhi']
+    >>> resolver = EntityResolver(fn, ["Li, Zhi", "Dragomir Radev", "Zhi V Li"])
+    >>> resolver.resolve('gta', "Zhi Li")   # only the new instructor is compared
+    ['Li, Zhi', 'Zhi V Li']
+    >>> resolver.set_decision('gta', "Zhi Li", ["Li, Zhi"])
+    >>> resolver.resolve('gta', "Zhi Li"), resolver.is_match('gta', "Zhi Li", "Zhi V Li")
+    (['Li, Zhi'], False)
+    >>> resolver.is_match('culpa', "Radev, Dragomir", "Dragomir R. Radev")   # not a catalog name
+    True
+    >>> resolver.set_decision('gscholar', "Zhi Li", ["Li, Zhi"], external_id='abc123')
+    >>> [resolver.is_match('gscholar', "Zhi Li", "Zhi V Li", profile) for profile in ['abc123', 'xyz']]
+    [False, True]
+    >>> EntityResolver(fn, ["Jane Roe"]).seq == EntityResolver(fn).seq   # numbers are shared through the file
+    True
+    """
+    def __init__(self, filename: str, names: Iterable[str] = ()):
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.conn = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS candidates (name TEXT PRIMARY KEY, seq INTEGER NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS decisions '
+                              '(source TEXT NOT NULL, external_name TEXT NOT NULL, matches TEXT NOT NULL, '
+                              'checked_upto INTEGER NOT NULL, manual INTEGER NOT NULL DEFAULT 0, '
+                              'PRIMARY KEY (source, external_name))')
+        self.seq: Dict[str, int] = {}
+        self.index = NameIndex()
+        self.active = set()
+        self.sync_candidates(names)
+
+    @property
+    def max_seq(self) -> int:
+        return max(self.seq.values(), default=0)
+
+    def sync_candidates(self, names: Iterable[str]):
+        """Makes `names` the current catalog names, new ones are numbered after the known ones.
+        Other processes may add candidates to the same file, so numbers are taken from the file
+        under its write lock. All known candidates are matched, results are limited to current names."""
+        names = list(dict.fromkeys(names))
+        with self.lock, self.conn:
+            known = dict(self.conn.execute('SELECT name, seq FROM candidates'))
+            new = [name for name in names if name not in known]
+            if len(new) > 0:
+                self.conn.execute('BEGIN IMMEDIATE')
+                max_seq = self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM candidates').fetchone()[0]
+                self.conn.executemany('INSERT OR IGNORE INTO candidates (name, seq) VALUES (?, ?)',
+                                      [(name, max_seq + i + 1) for i, name in enumerate(new)])
+                known = dict(self.conn.execute('SELECT name, seq FROM candidates'))
+        self.seq = known
+        self.active = set(names)
+        self.index = NameIndex(known.keys())
+
+    def _match(self, external_name: str, after_seq: int) -> List[str]:
+        return [name for name in self.index.match(external_name) if self.seq[name] > after_seq]
+
+    def resolve(self, source: str, external_name: str, external_id: Optional[str] = None) -> List[str]:
+        """Catalog names matching the external name"""
+        key = external_name if external_id is None else external_id
+        with self.lock:
+            row = self.conn.execute('SELECT matches, checked_upto, manual FROM decisions '
+                                    'WHERE source = ? AND external_name = ?', (source, key)).fetchone()
+        if row is None:
+            matches, checked_upto, manual = [], 0, False
+        else:
+            matches, checked_upto, manual = json.loads(row[0]), row[1], row[2]
+        max_seq = self.max_seq
+        if not manual and checked_upto < max_seq:
+            matches += self._match(external_name, checked_upto)
+            with self.lock, self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO decisions (source, external_name, matches, checked_upto) '
+                                  'VALUES (?, ?, ?, ?)', (source, key, json.dumps(matches), max_seq))
+        return [name for name in matches if name in self.active]
+
+    def resolve_many(self, source: str, external_names: Iterable[str]) -> Dict[str, List[str]]:
+        return {external_name: self.resolve(source, external_name) for external_name in external_names}
+
+    def is_match(self, source: str, external_name: str, name: str, external_id: Optional[str] = None) -> bool:
+        """Whether external name matches the catalog name. Names not in the catalog are compared directly"""
+        if name not in self.active:
+            return words_match2(name, external_name)
+        return name in self.resolve(source, external_name, external_id)
+
+    def set_decision(self, source: str, external_name: str, matches: List[str], external_id: Optional[str] = None):
+        """Stores manually reviewed matches"""
+        key = external_name if external_id is None else external_id
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO decisions (source, external_name, matches, checked_upto, manual) '
+                              'VALUES (?, ?, ?, ?, 1)', (source, key, json.dumps(matches), self.max_seq))
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+
+class PredictionCache:
+    """Persistent LRU cache of predicted class probabilities keyed by model input text.
+
+    The cache is emptied when `model_version` differs from the one it was filled with,
+    e.g. after re-training. Least recently used entries are evicted above `max_entries`.
+
+    >>> import tempfile
+    >>> fn = tempfile.mkdtemp() + '/cache.sqlite'
+    >>> cache = PredictionCache(fn, 'v1', max_entries=2)
+    >>> cache.put_many({'a': np.array([0.1, 0.9]), 'b': np.array([0.5, 0.5])})
+    >>> sorted(cache.get_many(['a', 'c']).keys())
+    ['a']
+    >>> cache.put_many({'c': np.array([1.0, 0.0])})   # evicts 'b' which was not used recently
+    >>> sorted(cache.get_many(['a', 'b', 'c']).keys())
+    ['a', 'c']
+    >>> len(PredictionCache(fn, 'v2').get_many(['a', 'c']))
+    0
+
+    Model version fingerprints only the files the model is loaded from:
+
+    >>> model_dir = tempfile.mkdtemp()
+    >>> for name in ['config.json', 'model.safetensors']:
+    ...     _ = open(model_dir + '/' + name, 'w').write(name)
+    >>> files = [model_dir + '/config.json', model_dir + '/model.safetensors', model_dir + '/vocab.txt']
+    >>> version = PredictionCache.model_version(files)
+    >>> _ = open(model_dir + '/model-int8.pt', 'w').write('int8')
+    >>> PredictionCache.model_version(files) == version
+    True
+    >>> PredictionCache.model_version(files[:1] + [model_dir + '/model-int8.pt']) == version
+    False
+    """
+    def __init__(self, filename: str, model_version: str, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # used from inference threads as well
+        self.conn = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS predictions '
+                              '(key TEXT PRIMARY KEY, proba TEXT NOT NULL, used REAL NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS predictions_used ON predictions (used)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'model_version'").fetchone()
+            if row is None or row[0] != model_version:
+                self.conn.execute('DELETE FROM predictions')
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model_version', ?)",
+                                  (model_version,))
+            # kept up to date by put_many() so the table isn't counted on every insert
+            self.count = self.conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+    @staticmethod
+    def key(model_input: str) -> str:
+        return hashlib.sha1(model_input.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def model_version(filenames: List[str]) -> str:
+        """Fingerprint of model files (names, sizes and modification times), missing files are skipped"""
+        h = hashlib.sha1()
+        for fn in filenames:
+            if os.path.exists(fn):
+                st = os.stat(fn)
+                h.update(f"{os.path.basename(fn)}:{st.st_size}:{st.st_mtime_ns};".encode('utf-8'))
+        return h.hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        result = {}
+        with self.lock, self.conn:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for key, proba in self.conn.execute(
+                        f'SELECT key, proba FROM predictions WHERE key IN ({placeholders})', chunk):
+                    result[key] = np.array(json.loads(proba))
+            if len(result) > 0:
+                now = time.time()
+                self.conn.executemany('UPDATE predictions SET used = ? WHERE key = ?',
+                                      [(now, key) for key in result.keys()])
+        return result
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        now = time.time()
+        rows = [(json.dumps(proba.tolist()), now, key) for key, proba in items.items()]
+        with self.lock, self.conn:
+            # counts rows actually added, keys already in the cache are updated
+            inserted = self.conn.executemany('INSERT OR IGNORE INTO predictions (proba, used, key) VALUES (?, ?, ?)',
+                                             rows).rowcount
+            if inserted < len(rows):
+                self.conn.executemany('UPDATE predictions SET proba = ?, used = ? WHERE key = ?', rows)
+            self.count += inserted
+            if self.count > self.max_entries:
+                self.count -= self.conn.execute('DELETE FROM predictions WHERE key IN '
+                                                '(SELECT key FROM predictions ORDER BY used LIMIT ?)',
+                                                (self.count - self.max_entries,)).rowcount
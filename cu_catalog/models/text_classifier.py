@@ -47,12 +47,19 @@ class TextClassifier(metaclass=ABCMeta):
     def extract_features2vector(self, row: dict) -> list:
         return self.dict2vect.convert(self.extract_features(row))
 
+    def extract_features_many(self, data: pd.DataFrame) -> list:
+        """Features of every row of data, without building a Series per row"""
+        return [self.extract_features(row) for row in data.to_dict('records')]
+
+    def extract_features2matrix(self, data: pd.DataFrame):
+        return self.dict2vect.convert_many(self.extract_features_many(data))
+
     def data_transform(self, data, test_size=0.2):
         # extract features
-        X = data.apply(lambda x: self.extract_features(x.to_dict()), axis=1).values
-        # transform features to vectors
-        self.dict2vect = Dict2Vect(X)
-        X = np.array(list(map(self.dict2vect.convert, X)))
+        X = self.extract_features_many(data)
+        # transform features to sparse vectors: word stems make them wide and mostly empty
+        self.dict2vect = Dict2Vect(X, sparse=True)
+        X = self.dict2vect.convert_many(X)
         Y = data[self.label_field_name]
 
         # train/test split
@@ -96,8 +103,7 @@ class TextClassifier(metaclass=ABCMeta):
         print()
 
         print("Evaluating the entire unbalanced data set:")
-        X = self.data.apply(lambda x: self.extract_features2vector(x.to_dict()), axis=1)
-        X = list(X)
+        X = self.extract_features2matrix(self.data)
         y = self.data[self.label_field_name]
 
         y_pred = self.predict(X)
@@ -1,13 +1,14 @@
+import hashlib
+import inspect
+import os
+import pickle
 from abc import ABCMeta, abstractmethod
 
 import numpy as np
 import torch
-from datasets import load_dataset
-from sklearn.metrics import accuracy_score, f1_score
-from sklearn.metrics import classification_report, confusion_matrix
-from scipy.special import softmax
-from transformers import AutoModelForSequenceClassification, AutoTokenizer, TrainingArguments, Trainer
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
 from cu_catalog import config
+from cu_catalog.models.prediction_cache import PredictionCache
 
 
 # DistilBERT based text classifier
@@ -16,8 +17,11 @@ class TextClassifierDBERT(metaclass=ABCMeta):
         self.data_filename = data_filename
         self.model_filename = model_filename
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.prediction_cache: PredictionCache or None = None
 
     def _load_data(self):
+        # training only imports are local to keep loading models for inference light
+        from datasets import load_dataset
         self.data = load_dataset("json", data_files=self.data_filename, split='train')
         self.data.set_format('pandas')
         self.dataset_train = load_dataset("json", data_files=self.data_filename, split='train[:70%]')
@@ -41,9 +45,63 @@ class TextClassifierDBERT(metaclass=ABCMeta):
         return 10, 2
 
     @abstractmethod
-    def tokenize(self, batch, return_tensors=None):
+    def make_input(self, row) -> str:
+        """Text fed to the model for a single row"""
         raise NotImplementedError
 
+    def tokenize(self, batch, return_tensors=None):
+        return self.tokenizer(self.make_input(batch), padding=True, truncation=True, return_tensors=return_tensors)
+
+    def tokenize_rows(self, rows, return_tensors=None):
+        """Tokenizes many rows into one padded batch"""
+        inputs = [self.make_input(row) for row in rows]
+        return self.tokenizer(inputs, padding=True, truncation=True, return_tensors=return_tensors)
+
+    def _tokenizer_version(self) -> str:
+        """Changes when tokenizer or model input format change"""
+        import transformers
+        h = hashlib.sha1()
+        for part in [self.tokenizer.name_or_path, transformers.__version__, str(len(self.tokenizer)),
+                     inspect.getsource(type(self).make_input)]:
+            h.update(part.encode('utf-8'))
+        return h.hexdigest()
+
+    def _encode(self, dataset, split_name: str):
+        """Tokenizes data set in batches with the fast tokenizer.
+
+        Encoded data set is cached on disk by data file hash and tokenizer version,
+        tokenized rows are cached by their text, so adding a few labeled rows only tokenizes those.
+        """
+        os.makedirs(config.DATA_WIKI_TOKENIZED_CACHE_DIR, exist_ok=True)
+        with open(self.data_filename, 'rb') as f:
+            data_hash = hashlib.sha1(f.read()).hexdigest()
+        tokenizer_version = self._tokenizer_version()
+        prefix = config.DATA_WIKI_TOKENIZED_CACHE_DIR + '/' + type(self).__name__ + '-'
+        rows_cache_filename = prefix + tokenizer_version[:16] + '.rows.pkl'
+        rows_cache = {}
+        if os.path.exists(rows_cache_filename):
+            with open(rows_cache_filename, 'rb') as f:
+                rows_cache = pickle.load(f)
+
+        def _tokenize_batch(batch):
+            rows = [dict(zip(batch.keys(), values)) for values in zip(*batch.values())]
+            inputs = [self.make_input(row) for row in rows]
+            keys = [hashlib.sha1(x.encode('utf-8')).hexdigest() for x in inputs]
+            missing = [i for i, key in enumerate(keys) if key not in rows_cache]
+            if len(missing) > 0:
+                # no padding here, trainer pads batches dynamically
+                encoded = self.tokenizer([inputs[i] for i in missing], truncation=True)
+                for j, i in enumerate(missing):
+                    rows_cache[keys[i]] = {field: encoded[field][j] for field in encoded.keys()}
+            fields = rows_cache[keys[0]].keys() if len(keys) > 0 else []
+            return {field: [rows_cache[key][field] for key in keys] for field in fields}
+
+        cache_filename = prefix + split_name + '-' + data_hash[:16] + '-' + tokenizer_version[:16] + '.arrow'
+        encoded_dataset = dataset.map(_tokenize_batch, batched=True, cache_file_name=cache_filename)
+        with open(rows_cache_filename, 'wb') as f:
+            pickle.dump(rows_cache, f)
+        return encoded_dataset
+
     def view_sample(self, idx):
         sample = self.data[idx].to_dict()
         # print(sample)
@@ -79,6 +137,8 @@ class TextClassifierDBERT(metaclass=ABCMeta):
 
 
     def fit(self):
+        from sklearn.metrics import accuracy_score, f1_score
+        from transformers import TrainingArguments, Trainer
         model_ckpt = "distilbert-base-uncased"
         num_labels = len(self.label_class_weights)
         self.model = AutoModelForSequenceClassification \
@@ -86,8 +146,8 @@ class TextClassifierDBERT(metaclass=ABCMeta):
             .to(self.device)
         self.tokenizer = AutoTokenizer.from_pretrained(model_ckpt)
 
-        encoded_train = self.dataset_train.map(self.tokenize)
-        encoded_test = self.dataset_test.map(self.tokenize)
+        encoded_train = self._encode(self.dataset_train, 'train')
+        encoded_test = self._encode(self.dataset_test, 'test')
 
         epochs, batch_size = self.training_params
 
@@ -150,24 +210,67 @@ class TextClassifierDBERT(metaclass=ABCMeta):
         self.show_confusion_matrix(y_test, y_pred)
 
     def eval_results(self, y_test, y_pred, show_predictions=True):
+        from sklearn.metrics import classification_report
         print(classification_report(y_test, y_pred))
         if show_predictions:
             self.show_true_pred(y_test, y_pred)
 
     def show_confusion_matrix(self, y_test, y_pred):
+        from sklearn.metrics import confusion_matrix
         print("Confusion Matrix:")
         print(confusion_matrix(y_test, y_pred))
 
+    def _prepare_inference(self):
+        """Switches model to eval mode (disables dropout) e.g. after training"""
+        if self.model.training:
+            self.model.eval()
+
+    def _cached(self, rows, predict_func):
+        """Predicts only rows missing in the prediction cache"""
+        if self.prediction_cache is None:
+            return predict_func(rows)
+        rows = list(rows)
+        keys = [PredictionCache.key(self.make_input(row)) for row in rows]
+        predicted = np.empty((len(rows), len(self.label_class_weights)), dtype=np.float32)
+        cached = self.prediction_cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        if len(missing) > 0:
+            predicted_missing = predict_func([rows[i] for i in missing])
+            predicted[missing] = predicted_missing
+            self.prediction_cache.put_many({keys[i]: p for i, p in zip(missing, predicted_missing)})
+        for i, key in enumerate(keys):
+            if key in cached:
+                predicted[i] = cached[key]
+        return predicted
+
     def predict_proba(self, rows):
-        predicted = []
-        for row in rows:
-            inputs = self.tokenize(row, return_tensors='pt')
-            inputs = inputs.to(self.device)
-            logits = self.model(**inputs)
-            logits = logits.logits.cpu().detach().numpy()
-            proba = softmax(logits, axis=1)
-            predicted.append(proba[0])
-        return np.array(predicted)
+        return self._cached(rows, self._predict_proba)
+
+    def predict_proba_batch(self, rows, batch_size=32):
+        """Same as predict_proba but runs padded batches of rows through the model"""
+        return self._cached(rows, lambda r: self._predict_proba_batch(r, batch_size))
+
+    def _predict_proba(self, rows):
+        self._prepare_inference()
+        predicted = np.empty((len(rows), len(self.label_class_weights)), dtype=np.float32)
+        with torch.inference_mode():
+            for i, row in enumerate(rows):
+                inputs = self.tokenize(row, return_tensors='pt')
+                inputs = inputs.to(self.model.device)
+                logits = self.model(**inputs).logits
+                predicted[i] = torch.softmax(logits[0], dim=-1).cpu().numpy()
+        return predicted
+
+    def _predict_proba_batch(self, rows, batch_size=32):
+        self._prepare_inference()
+        predicted = np.empty((len(rows), len(self.label_class_weights)), dtype=np.float32)
+        with torch.inference_mode():
+            for i in range(0, len(rows), batch_size):
+                inputs = self.tokenize_rows(rows[i:i + batch_size], return_tensors='pt')
+                inputs = inputs.to(self.model.device)
+                logits = self.model(**inputs).logits
+                predicted[i:i + batch_size] = torch.softmax(logits, dim=-1).cpu().numpy()
+        return predicted
 
     def predict(self, rows):
         proba = self.predict_proba(rows)
@@ -177,11 +280,51 @@ class TextClassifierDBERT(metaclass=ABCMeta):
     def persist_model(self):
         self.trainer.save_model(self.model_filename)
 
-    def load_model(self):
+    @property
+    def quantized_model_filename(self):
+        return self.model_filename + '/model-int8.pt'
+
+    @staticmethod
+    def _quantize(model):
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def export_quantized(self):
+        """Saves dynamically quantized (INT8 linear layers) version of the loaded model for CPU inference"""
+        quantized = self._quantize(self.model.cpu().eval())
+        torch.save(quantized.state_dict(), self.quantized_model_filename)
+        self.model.to(self.device)
+
+    def _model_files(self, quantized: bool):
+        """Files `load_model()` reads, the prediction cache is tied to their versions"""
+        weights = [self.quantized_model_filename] if quantized \
+            else [self.model_filename + '/model.safetensors', self.model_filename + '/pytorch_model.bin']
+        return weights + [self.model_filename + '/' + fn for fn in
+                          ['config.json', 'tokenizer.json', 'tokenizer_config.json', 'vocab.txt',
+                           'special_tokens_map.json']]
+
+    def load_model(self, quantized: bool = None):
+        if quantized is None:
+            quantized = config.MODEL_QUANTIZED
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_filename, local_files_only=True)
-        self.model = AutoModelForSequenceClassification \
-            .from_pretrained(self.model_filename, local_files_only=True) \
-            .to(self.device)
+        if quantized:
+            # quantized kernels run on CPU only, the model is quantized the same way as in export
+            # and gets the saved INT8 weights
+            model_config = AutoConfig.from_pretrained(self.model_filename, local_files_only=True)
+            self.model = self._quantize(AutoModelForSequenceClassification.from_config(model_config).eval())
+            self.model.load_state_dict(torch.load(self.quantized_model_filename, map_location="cpu",
+                                                  weights_only=True))
+        else:
+            self.model = AutoModelForSequenceClassification \
+                .from_pretrained(self.model_filename, local_files_only=True) \
+                .to(self.device)
+        self.model.eval()
+        if config.TORCH_NUM_THREADS > 0:
+            torch.set_num_threads(config.TORCH_NUM_THREADS)
+        if config.PREDICTION_CACHE_ENABLED:
+            variant = '.int8' if quantized else ''
+            version = PredictionCache.model_version(self._model_files(quantized))
+            self.prediction_cache = PredictionCache(self.model_filename + variant + '.predictions.sqlite', version,
+                                                    config.PREDICTION_CACHE_MAX_ENTRIES)
 
 
 if 'display' not in vars():
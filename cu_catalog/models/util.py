@@ -1,11 +1,20 @@
 import re
 import unidecode
+from functools import lru_cache
 from typing import Any
 
+import numpy as np
 import textdistance
 from nltk import word_tokenize, PorterStemmer
 from nltk.corpus import stopwords
 
+try:
+    # compiled batch similarity, textdistance is used when missing
+    from rapidfuzz import process as rf_process
+    from rapidfuzz.distance import JaroWinkler as rf_jaro_winkler
+except ImportError:
+    rf_process = rf_jaro_winkler = None
+
 
 stop_words = set(stopwords.words('english'))
 punctuation = '!@#$%^&*()<>?/\\][}{\'";:,.'
@@ -19,30 +28,88 @@ class Dict2Vect:
     [3, 0, 0, 0]
     >>> d2v.convert({'c': 2, 'z': 88})
     [0, 0, 2, 0]
+
+    In sparse mode `convert_many` returns a CSR matrix, only present keys are stored:
+
+    >>> d2v = Dict2Vect([{'a': True, 'b': True}, {'c': True}], sparse=True)
+    >>> m = d2v.convert_many([{'a': True}, {'c': True, 'z': True}])
+    >>> m.shape, m.nnz, m.toarray().tolist()
+    ((2, 3), 2, [[1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
     """
-    def __init__(self, data, absent_value: Any = False):
+    def __init__(self, data, absent_value: Any = False, sparse: bool = False):
         self.keys = list({k for x in data for k in x.keys()})
         self.keys.sort()
         self.absent_value = absent_value
+        self.sparse = sparse
+        if sparse and absent_value:
+            raise ValueError("Sparse vectors need a zero absent value")
+        self.key_index = {k: i for i, k in enumerate(self.keys)}
 
     def convert(self, row: dict):
         return [row[k] if k in row else self.absent_value for k in self.keys]
 
+    def convert_many(self, rows):
+        """Converts rows into a matrix: CSR in sparse mode, dense numpy array otherwise"""
+        # models pickled before sparse mode have no index
+        key_index = getattr(self, 'key_index', None)
+        if key_index is None:
+            key_index = self.key_index = {k: i for i, k in enumerate(self.keys)}
+        if not getattr(self, 'sparse', False):
+            return np.array([self.convert(row) for row in rows])
+
+        from scipy.sparse import csr_matrix
+        indptr, indices, values = [0], [], []
+        for row in rows:
+            for k, v in row.items():
+                i = key_index.get(k)
+                if i is not None and v:
+                    indices.append(i)
+                    values.append(v)
+            indptr.append(len(indices))
+        return csr_matrix((np.array(values, dtype=np.float32), indices, indptr),
+                          shape=(len(indptr) - 1, len(self.keys)))
+
 
 stemmer = PorterStemmer()
 
+# the same department names, class titles and interests are stemmed over and over
+STEM_CACHE_SIZE = 100000
+TOKENIZE_CACHE_SIZE = 10000
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word: str) -> str:
+    return stemmer.stem(word)
+
+
+@lru_cache(maxsize=TOKENIZE_CACHE_SIZE)
+def _word_tokenize(text: str) -> tuple:
+    return tuple(word_tokenize(text))
+
 
 def extract_word_stems2dict(text, key_prefix="__word_", remove_stopwords=False):
     """Extracts stems for every word and puts in a dict for use as features"""
     features = {}
-    tokens = word_tokenize(text)
-    for t in tokens:
+    for t in _word_tokenize(text):
         if remove_stopwords and (t in stop_words or t in punctuation):
             continue
-        features[key_prefix + stemmer.stem(t)] = True
+        features[key_prefix + stem(t)] = True
     return features
 
 
+def extract_word_stems2dict_many(texts, key_prefix="__word_", remove_stopwords=False) -> list:
+    """`extract_word_stems2dict` for many texts, repeated texts are processed once
+
+    >>> extract_word_stems2dict_many(["Computer Science", "Physics", "Computer Science"], remove_stopwords=True)
+    [{'__word_comput': True, '__word_scienc': True}, {'__word_physic': True}, {'__word_comput': True, '__word_scienc': True}]
+    """
+    features = {text: None for text in texts}
+    for text in features.keys():
+        features[text] = extract_word_stems2dict(text, key_prefix, remove_stopwords)
+    # a copy for every text so callers may change them
+    return [dict(features[text]) for text in texts]
+
+
 def words_match(search, text):
     """Match each word from `search` in `text`"""
     text = text.lower()
@@ -53,9 +120,62 @@ def words_match(search, text):
     return True
 
 
+def sort_name(name: str) -> str:
+    """Puts "Last, First" names in "First Last" order"""
+    if ',' in name:
+        p1, p2 = name.split(',', 1)
+        name = p2 + ' ' + p1
+        name = re.sub(r'\s+', ' ', name.strip())
+    return name
+
+
+def name_split(name: str) -> list:
+    """Lowercase ascii name parts without initials
+
+    >>> name_split("Negrón-Muntaner, Frances V.")
+    ['negron', 'muntaner', 'frances']
+    """
+    name = re.split(r'[^\w]', name.lower())
+    return [unidecode.unidecode(w) for w in name if len(w) > 1]
+
+
+class NormalizedName:
+    """Name with parts prepared for matching once, so comparing it with many other names
+    costs set intersections and cached similarities only. Use `NormalizedName.of()`.
+
+    >>> n = NormalizedName.of("Negrón-Muntaner, Frances V.")
+    >>> n.sorted, n.parts
+    ('Frances V. Negrón-Muntaner', ['frances', 'negron', 'muntaner'])
+    >>> NormalizedName.of(n) is n, NormalizedName.of("Li, Zhi") is NormalizedName.of("Li, Zhi")
+    (True, True)
+    """
+    __slots__ = ('name', 'sorted', 'lower', 'parts', 'part_set')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.sorted = sort_name(name)
+        self.lower = self.sorted.lower()
+        self.parts = name_split(self.sorted)
+        self.part_set = frozenset(self.parts)
+
+    @staticmethod
+    def of(name) -> 'NormalizedName':
+        if isinstance(name, NormalizedName):
+            return name
+        return _normalized_name(name)
+
+    def __repr__(self):
+        return 'NormalizedName(%r)' % self.name
+
+
+@lru_cache(maxsize=100000)
+def _normalized_name(name: str) -> NormalizedName:
+    return NormalizedName(name)
+
+
 def words_match2(search, text):
     """Same as `words_match` but skip short words - useful for matching names
-    and skipping the middle name initial.
+    and skipping the middle name initial. Names can be strings or `NormalizedName`.
 
     >>> words_match2("Zhi Li", "Ying, Zhiliang")
     False
@@ -88,35 +208,141 @@ def words_match2(search, text):
     >>> words_match2("Alfred Mac Adam", "MacAdam, Alfred")
     True
     """
-    def sort_name(name: str):
-        if ',' in name:
-            p1, p2 = name.split(',', 1)
-            name = p2 + ' ' + p1
-            name = re.sub(r'\s+', ' ', name.strip())
-        return name
-    def name_split(name: str):
-        name = re.split('[^\w]', name.lower())
-        return [unidecode.unidecode(w) for w in name if len(w) > 1]
-    text, search = sort_name(text), sort_name(search)
-    text_lst = name_split(text)
-    search_lst = name_split(search)
-    intersection = set(text_lst).intersection(set(search_lst))
-    intersection = len(intersection)
+    text, search = NormalizedName.of(text), NormalizedName.of(search)
+    text_lst = text.parts
+    search_lst = search.parts
+    intersection = len(text.part_set & search.part_set)
     # if 2 or more name parts match, then count it the same name
     if intersection >= 2 or (len(text_lst) == 1 and intersection == 1):
         return True
     # Try to match similarity
     intersection = 0
-    for w1 in text_lst:
-        for w2 in search_lst:
-            if str_similarity(w1, w2) >= 0.95:
-                intersection += 1
-                break
+    if len(text_lst) > 0 and len(search_lst) > 0:
+        intersection = int((str_similarity_matrix(text_lst, search_lst) >= 0.95).any(axis=1).sum())
     if intersection >= 2 or (len(text_lst) == 1 and intersection == 1):
         return True
     # See if entire names are very similar
-    return str_similarity(search, text) >= 0.97
+    return _word_similarity(search.lower, text.lower) >= 0.97
+
+
+@lru_cache(maxsize=100000)
+def _word_similarity(w1: str, w2: str) -> float:
+    # lowercase inputs only
+    if rf_jaro_winkler is not None:
+        return rf_jaro_winkler.normalized_similarity(w1, w2)
+    return textdistance.jaro_winkler.normalized_similarity(w1, w2)
+
 
 def str_similarity(str1, str2):
     str1, str2 = str1.lower(), str2.lower()
     return textdistance.jaro_winkler.normalized_similarity(str1, str2)
+
+
+def str_similarity_matrix(strs1, strs2) -> np.ndarray:
+    """`str_similarity` of every string from `strs1` (rows) with every string from `strs2` (columns)
+
+    >>> str_similarity_matrix(["Zhi", "antoni"], ["zhi", "Antonio", "Li"]).round(3).tolist()
+    [[1.0, 0.0, 0.0], [0.0, 0.971, 0.0]]
+    """
+    strs1 = [s.lower() for s in strs1]
+    strs2 = [s.lower() for s in strs2]
+    if rf_process is not None:
+        return rf_process.cdist(strs1, strs2, scorer=rf_jaro_winkler.normalized_similarity,
+                                dtype=np.float64, workers=-1 if len(strs1) * len(strs2) > 10000 else 1)
+    return np.array([[_word_similarity(s1, s2) for s2 in strs2] for s1 in strs1]).reshape(len(strs1), len(strs2))
+
+
+def str_similarity_many(str1, strs) -> np.ndarray:
+    """`str_similarity` of `str1` with each of `strs`
+
+    >>> str_similarity_many("Dragomir Radev", ["dragomir radev", "Dragomir R. Radev"]).round(3).tolist()
+    [1.0, 0.965]
+    """
+    return str_similarity_matrix([str1], strs)[0]
+
+
+def soundex(word: str) -> str:
+    """American soundex code of a word
+
+    >>> soundex('robert'), soundex('rupert'), soundex('tymczak'), soundex('pfister')
+    ('R163', 'R163', 'T522', 'P236')
+    """
+    codes = {c: str(d) for d, letters in enumerate(['aeiouy', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'])
+             for c in letters}
+    word = unidecode.unidecode(word).lower()
+    word = ''.join(c for c in word if c.isalpha())
+    if not word:
+        return ''
+    result = word[0].upper()
+    last = codes.get(word[0], '')
+    for c in word[1:]:
+        code = codes.get(c, '')  # h and w don't separate same codes
+        if code == '0':
+            last = ''
+        elif code and code != last:
+            result += code
+            last = code
+        if len(result) == 4:
+            break
+    return result.ljust(4, '0')
+
+
+class NameIndex:
+    """Finds names matching with `words_match2` without comparing to every indexed name.
+
+    Names are normalized once when indexed and blocked by their parts, part prefixes, soundex
+    codes and initials. A query is compared with `words_match2` only to names sharing a block key.
+    Matches are indexed names `n` where `words_match2(n, query)` is true.
+
+    >>> index = NameIndex(["Li, Zhi", "Ying, Zhiliang", "Dragomir Radev", "Alfred MacAdam", "Hee-Jin Kim"])
+    >>> index.match("Zhi Li")
+    ['Li, Zhi']
+    >>> index.match("Dragomir R. Radev"), index.match("MacAdam, Alfred"), index.match("Hee Jin Kim")
+    (['Dragomir Radev'], ['Alfred MacAdam'], ['Hee-Jin Kim'])
+    >>> index.match("Nobody Known")
+    []
+    """
+    def __init__(self, names=()):
+        self.names = []
+        self.normalized = []
+        self.blocks = {}
+        for name in names:
+            self.add(name)
+
+    @staticmethod
+    def block_keys(name) -> set:
+        name = NormalizedName.of(name)
+        parts = name.parts
+        keys = set()
+        for part in parts:
+            keys.add('w:' + part)
+            keys.add('p:' + part[:3])
+            keys.add('s:' + soundex(part))
+        if len(parts) >= 2:
+            keys.add('i:' + parts[0][0] + parts[-1][0])
+        # very similar full names have the same beginning
+        full = re.sub(r'[^\w]', '', unidecode.unidecode(name.lower))
+        if full:
+            keys.add('f:' + full[:4])
+        return keys
+
+    def add(self, name: str):
+        i = len(self.names)
+        normalized = NormalizedName(name)
+        self.names.append(name)
+        self.normalized.append(normalized)
+        for key in self.block_keys(normalized):
+            self.blocks.setdefault(key, []).append(i)
+
+    def _candidates(self, name: NormalizedName) -> list:
+        found = set()
+        for key in self.block_keys(name):
+            found.update(self.blocks.get(key, []))
+        return sorted(found)
+
+    def candidates(self, name) -> list:
+        return [self.names[i] for i in self._candidates(NormalizedName.of(name))]
+
+    def match(self, name) -> list:
+        name = NormalizedName.of(name)
+        return [self.names[i] for i in self._candidates(name) if words_match2(self.normalized[i], name)]
@@ -23,18 +23,17 @@ class WikiArticleClassifier(TextClassifierDBERT):
     def training_params(self):
         return 20, 4
 
-    def tokenize(self, batch, return_tensors=None):
-        if util.words_match2(batch['name'], batch['wiki_title']):
+    def make_input(self, row) -> str:
+        if util.words_match2(row['name'], row['wiki_title']):
             clue_name = "Yes"
         else:
             clue_name = "No"
 
-        inputs = batch['name'] \
-                 + ' [SEP] ' + batch['department'] \
-                 + ' [SEP] ' + clue_name \
-                 + ' [SEP] ' + batch['wiki_title'] \
-                 + " [SEP] " + batch['wiki_page']
-        return self.tokenizer(inputs, padding=True, truncation=True, return_tensors=return_tensors)
+        return row['name'] \
+               + ' [SEP] ' + row['department'] \
+               + ' [SEP] ' + clue_name \
+               + ' [SEP] ' + row['wiki_title'] \
+               + " [SEP] " + row['wiki_page']
 
     def eval_results(self, y_test, y_pred, show_predictions=True):
         mc = [i for i, (t, p) in enumerate(zip(y_test, y_pred)) if t == 1 and t != p]
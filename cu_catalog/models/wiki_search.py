@@ -1,10 +1,10 @@
-import pandas as pd
+import json
 
-from sklearn.metrics import confusion_matrix
+import pandas as pd
 
-from datasets import Dataset
 from cu_catalog import config
 from cu_catalog.models.text_classifier_dbert import TextClassifierDBERT
+from cu_catalog.models.util import name_split, words_match2
 
 
 class WikiSearchClassifier(TextClassifierDBERT):
@@ -29,33 +29,67 @@ class WikiSearchClassifier(TextClassifierDBERT):
     def training_params(self):
         return 30, 32
 
-    def tokenize(self, batch, return_tensors=None):
-        inputs = batch['name'] \
-                 + ' from departments of' + batch['department'] \
-                 + '[SEP]' + batch['search_results.title'] \
-                 + '[SEP]' + batch['search_results.snippet']
-        return self.tokenizer(inputs, padding=True, truncation=True, return_tensors=return_tensors)
+    @staticmethod
+    def prefilter(row) -> bool:
+        """Cheap first stage: False if the search result is clearly irrelevant and the model can be skipped,
+        i.e. the title has no name parts of the instructor.
+
+        >>> WikiSearchClassifier.prefilter({'name': 'Zhi Li', 'search_results.title': 'Li Zhi (painter)'})
+        True
+        >>> WikiSearchClassifier.prefilter({'name': 'Zhi Li', 'search_results.title': 'Columbia University'})
+        False
+        """
+        name, title = row['name'], row['search_results.title']
+        return not set(name_split(name)).isdisjoint(name_split(title)) or words_match2(name, title)
+
+    def prefilter_report(self, dataset=None):
+        """Shows how many labeled relevant / possibly relevant results the prefilter would reject"""
+        if dataset is None:
+            dataset = self.dataset_test
+        rows = list(dataset)
+        rejected = [row for row in rows if not self.prefilter(row)]
+        lost = [row for row in rejected if row[self.label_field_name] != self.LABEL_IRRELEVANT]
+        print("Prefilter rejected %s of %s search results" % (len(rejected), len(rows)))
+        print("  of them labeled relevant or possibly relevant: %s" % len(lost))
+        for row in lost:
+            print("    ", row['name'], '->', row['search_results.title'])
+
+    def make_input(self, row) -> str:
+        return row['name'] \
+               + ' from departments of' + row['department'] \
+               + '[SEP]' + row['search_results.title'] \
+               + '[SEP]' + row['search_results.snippet']
 
     def _load_data(self):
-        super(WikiSearchClassifier, self)._load_data()
-        def transf(data):
-            dataf = data
-            data.set_format('pandas')
-            data = data[:].T.to_dict().values()
-            for x in data:
-                x['search_results'] = list(x['search_results'])
-            data = pd.json_normalize(data,
-                                     'search_results', ['name', 'department'],
-                                     record_prefix='search_results.')
-            data['labels'] = data['search_results.label']
-            dataf.set_format(None)
-            return Dataset.from_pandas(data)
-        self.data = transf(self.data)
-        self.dataset_train = transf(self.dataset_train)
-        self.dataset_test = transf(self.dataset_test)
-
+        """Reads labeled JSONL once flattening search results into rows.
+        Splits by samples the same way as 'train[:70%]' / 'train[70%:]' of the base class."""
+        from datasets import Dataset
+        columns = {'name': [], 'department': [],
+                   'search_results.title': [], 'search_results.snippet': [], 'search_results.label': []}
+        sample_starts = []  # first row of each sample
+        with open(self.data_filename, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                sample = json.loads(line)
+                sample_starts.append(len(columns['name']))
+                for sr in sample['search_results']:
+                    columns['name'].append(sample['name'])
+                    columns['department'].append(sample['department'])
+                    columns['search_results.title'].append(sr['title'])
+                    columns['search_results.snippet'].append(sr['snippet'])
+                    columns['search_results.label'].append(sr.get('label'))
+        columns['labels'] = columns['search_results.label']
+        num_rows = len(columns['name'])
+
+        train_samples = int(round(len(sample_starts) * 70 / 100.0))
+        train_rows = sample_starts[train_samples] if train_samples < len(sample_starts) else num_rows
+        self.data = Dataset.from_dict(columns)
+        self.dataset_train = self.data.select(range(train_rows))
+        self.dataset_test = self.data.select(range(train_rows, num_rows))
 
     def show_confusion_matrix(self, y_test, y_pred):
+        from sklearn.metrics import confusion_matrix
         print("Confusion Matrix:")
         labels = ['Irrelevant', 'Possible', 'Relevant']
         print(pd.DataFrame(confusion_matrix(y_test, y_pred),
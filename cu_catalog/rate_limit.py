@@ -0,0 +1,147 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Limits request rate across threads: `acquire()` blocks until a token is available.
+    Tokens are added at `rate` per second up to `capacity`, so short bursts are allowed.
+
+    >>> now = [0.0]
+    >>> bucket = TokenBucket(rate=0.5, capacity=2, clock=lambda: now[0],
+    ...                      sleep=lambda s: now.__setitem__(0, now[0] + s))
+    >>> [bucket.acquire() for _ in range(4)]   # seconds waited: burst of 2, then 1 per 2 seconds
+    [0.0, 0.0, 2.0, 2.0]
+    >>> now[0]
+    4.0
+    """
+    def __init__(self, rate: float, capacity: float = 1, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Any] = time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Takes tokens, waiting as needed. Returns seconds waited"""
+        waited = 0.0
+        with self.lock:
+            # waiting under the lock keeps requests in arrival order
+            self._refill()
+            while self.tokens < tokens:
+                wait = (tokens - self.tokens) / self.rate
+                self.sleep(wait)
+                waited += wait
+                self._refill()
+            self.tokens -= tokens
+        return waited
+
+
+def rate_limited(items: Iterable[Any], bucket: TokenBucket, page_size: int = 1) -> Iterator[Any]:
+    """Takes a token from `bucket` before each page of lazily fetched `items` (e.g. paged search results)
+    after the first one, which is usually fetched when the search is made.
+
+    >>> bucket = TokenBucket(rate=1, capacity=10, clock=lambda: 0.0)
+    >>> len(list(rate_limited(range(25), bucket, page_size=10)))
+    25
+    >>> bucket.tokens   # for the 2nd and 3rd pages
+    8.0
+    """
+    items = iter(items)
+    taken = 0
+    while True:
+        if taken > 0 and taken % page_size == 0:
+            bucket.acquire()
+        item = next(items, rate_limited)
+        if item is rate_limited:
+            return
+        yield item
+        taken += 1
+
+
+class IdentityPool:
+    """Round robin of identities (proxies, sessions...) to switch to when the current one gets blocked.
+    `apply(identity)` is called on each switch to make the identity active.
+
+    >>> pool = IdentityPool(['p1', 'p2'], apply=lambda p: print('using', p))
+    using p1
+    >>> pool.rotate(), pool.rotate(), pool.current
+    using p2
+    using p1
+    ('p2', 'p1', 'p1')
+    >>> IdentityPool([]).current is None
+    True
+    """
+    def __init__(self, identities: Iterable[Any], apply: Optional[Callable[[Any], Any]] = None):
+        self.identities = list(identities)
+        self.apply = apply
+        self.lock = threading.Lock()
+        self._cycle = itertools.cycle(self.identities)
+        self.current = None
+        if len(self.identities) > 0:
+            self._switch()
+
+    def _switch(self):
+        self.current = next(self._cycle)
+        if self.apply is not None:
+            self.apply(self.current)
+
+    def rotate(self, blocked: Any = None):
+        """Switches to the next identity. Workers that saw `blocked` being blocked
+        switch only once when several of them fail at the same time."""
+        with self.lock:
+            if len(self.identities) > 0 and (blocked is None or blocked == self.current):
+                logger.warning("Switching identity from %s", self.current)
+                self._switch()
+            return self.current
+
+
+def run_worker_pool(items: Iterable[Any], work: Callable[[Any], Any], num_workers: int,
+                    on_result: Callable[[Any, Any], Any], should_stop: Callable[[], bool] = lambda: False) -> int:
+    """Runs blocking `work(item)` for items in `num_workers` threads keeping that many in flight.
+    `on_result(item, result)` runs in the event loop thread one at a time, so it can update shared state.
+    Stops taking new items when `should_stop()` is true, items in flight are finished.
+    Returns number of processed items.
+
+    >>> results = []
+    >>> run_worker_pool(range(10), lambda x: x * x, 3, lambda x, r: results.append(r))
+    10
+    >>> sorted(results)
+    [0, 1, 4, 9, 16, 25, 36, 49, 64, 81]
+    >>> run_worker_pool(range(10), lambda x: x, 1, lambda x, r: None, should_stop=lambda: len(results) >= 10)
+    0
+    """
+    items = iter(items)
+    processed = [0]
+
+    async def _worker():
+        while not should_stop():
+            item = next(items, _worker)
+            if item is _worker:
+                return
+            try:
+                result = await asyncio.to_thread(work, item)
+            except Exception as e:
+                logger.exception("Failed processing %s: %s", item, e)
+                continue
+            on_result(item, result)
+            processed[0] += 1
+
+    async def _run():
+        await asyncio.gather(*[_worker() for _ in range(num_workers)])
+
+    asyncio.run(_run())
+    return processed[0]
@@ -1,102 +1,162 @@
 # Crawling Google Scholar profiles of instructors
-# Because Google bans too frequent requests, this script needs not to be effient
-# and actually needs to
+# Because Google bans too frequent requests, all requests go through a token bucket
+# limiting the global request rate. Lookups run in a worker pool, but scholarly isn't thread safe,
+# so its requests are made one at a time.
 
+import itertools
 import json
 import os
-import time
+import random
+import threading
 
 import pandas as pd
-from scholarly import scholarly
+from scholarly import scholarly, DOSException, MaxTriesExceededException
 import models.cudata as cudata
-import random
 from columbia_crawler import util
 from cu_catalog import config
-from cu_catalog.models.util import words_match2
+from cu_catalog.models.entity_resolution import EntityResolver
+from cu_catalog.rate_limit import IdentityPool, TokenBucket, rate_limited, run_worker_pool
 
 # Configuration options
-MIN_WAIT, MAX_WAIT = 7, 60
-MAX_PROCESS = 300
+MAX_PROCESS = config.SCHOLAR_MAX_PROCESS
 UPDATE_MIN_DAYS = 0
 UPDATE_MAX_DAYS = 90
+# requests per instructor: search (or profile) and filling indices
+REQUESTS_PER_INSTRUCTOR = 2
+# author search results are fetched in pages of this size while iterating them
+SEARCH_PAGE_SIZE = 10
 
 # logger setup
 logger = config.get_logger('scholar', 'scholar.log')
 
 # load data
 instructors = cudata.load_instructors()
-instructors_internal_db = util.InstructorsInternalDb(['gscholar_last_search', 'gscholar_last_update'])
+# changes since the last full store are logged, apply them if the previous run crashed
+delta_log = cudata.InstructorsDeltaLog(config.DATA_GSCHOLAR_DELTA_LOG)
+replayed = delta_log.replay(instructors)
+if replayed > 0:
+    logger.info("Replayed %s changes from the previous run", replayed)
+instructors_internal_db = util.open_instructors_internal_db(['gscholar_last_search', 'gscholar_last_update'])
+entity_resolver = EntityResolver(config.DATA_ENTITY_RESOLUTION_DB, instructors.keys())
 
 # compute overall progress
-def _check_date(x):
-    return util.InstructorsInternalDb.recent_threshold(x, UPDATE_MIN_DAYS, UPDATE_MAX_DAYS)
-df = instructors_internal_db.df_internal
 # TODO need to join instructors here and sheck if 'gscholar' is set or not: need to update or search
-df = df[df['gscholar_last_search'].apply(_check_date)]
-to_process = len(df)
-total = len(instructors_internal_db.df_internal)
+to_process = len(instructors_internal_db.due_instructors(instructors.keys(), 'gscholar_last_search',
+                                                         UPDATE_MIN_DAYS, UPDATE_MAX_DAYS))
+total = len(instructors)
 logger.info("Overall progress: %s / %s", total - to_process, total)
 will_process = min(to_process, MAX_PROCESS)
 logger.info("Today will process: %s / %s", will_process, to_process)
 
 # print estimate
-estimate_min = will_process * (MIN_WAIT + (MAX_WAIT - MIN_WAIT)/2 + 5) / 60
+estimate_min = will_process * REQUESTS_PER_INSTRUCTOR / config.SCHOLAR_REQUESTS_PER_MINUTE
 logger.info("Processing %s will take about %.1f mins or %.1f hours.",
             will_process, estimate_min, estimate_min / 60)
 
+
+def _use_proxy(proxy: str):
+    from scholarly import ProxyGenerator
+    pg = ProxyGenerator()
+    pg.SingleProxy(http=proxy, https=proxy)
+    scholarly.use_proxy(pg)
+
+
+# scholarly keeps one session per process and isn't thread safe: workers make its requests one at a time
+# and share the identity, switching it together when blocked
+bucket = TokenBucket(config.SCHOLAR_REQUESTS_PER_MINUTE / 60, config.SCHOLAR_REQUESTS_BURST)
+identities = IdentityPool(config.SCHOLAR_PROXIES, apply=_use_proxy)
+scholarly_lock = threading.Lock()
+# errors of blocked requests (captcha, too many requests)
+BLOCKED_ERRORS = (DOSException, MaxTriesExceededException)
+blocks_in_row = 0
+
+
 def _save():
-    """ Saves progress """
+    """ Saves progress: changed instructors are already in delta log """
+    delta_log.checkpoint()
+    instructors_internal_db.checkpoint()
+    unsure_file.flush()
+
+
+def _store():
+    """ Stores all instructors and drops delta log merged into them """
     df_json = pd.DataFrame(instructors.values())
     cudata.store_instructors(df_json)
+    delta_log.clear()
     instructors_internal_db.store()
-    unsure_file.flush()
-
+    instructors_internal_db.close()
 
-os.makedirs(config.DATA_GSCHOLAR_DIR, exist_ok=True)
-unsure_file = open(config.DATA_GSCHOLAR_UNSURE_FILENAME, 'a')  # list of possible matches
 
-names = list(instructors.keys())
-random.seed(0)
-random.shuffle(names)
-pictures = {}
-num_processed = 0
-num_found = 0
-num_possible = 0
-for instructor_name in names:
+def _due(instructor_name: str) -> bool:
     if not instructors_internal_db.check_its_time(instructor_name, 'gscholar_last_search',
                                                   UPDATE_MIN_DAYS, UPDATE_MAX_DAYS):
-        continue
+        return False
     if instructors[instructor_name]['gscholar'] \
             and instructors_internal_db.check_its_time(instructor_name, 'gscholar_last_update',
                                                        UPDATE_MIN_DAYS, UPDATE_MAX_DAYS):
         # skipping cause not expired 'gscholar_last_update' and gscholar already exists
-        continue
-
-    # search or update
-    if instructors[instructor_name]['gscholar']:
-        logger.info("Updating instructor: %s", instructor_name)
-        result = scholarly.search_author_id(instructors[instructor_name]['gscholar']['scholar_id'])
-        found = True
-    else:
-        logger.info("Searching instructor: %s", instructor_name)
-        results = scholarly.search_author(instructor_name)
-        # print("Our db:", instructors[instructor_name])
-        found = False
-        for result in results:
-            # print("Google Scholar result: ", result)
-            if ('columbia' in result['affiliation'].lower() and 'british' not in result['affiliation'].lower()) \
-                    or 'columbia' in result['email_domain'].lower() \
-                    or 'barnard' in result['email_domain'].lower():
+        return False
+    return True
+
+
+def lookup(instructor_name: str) -> dict:
+    """Google Scholar requests for one instructor. Runs in worker threads, doesn't change shared data"""
+    global blocks_in_row
+    possible = []
+    with scholarly_lock:
+        identity = identities.current
+        try:
+            # search or update
+            bucket.acquire()
+            if instructors[instructor_name]['gscholar']:
+                logger.info("Updating instructor: %s", instructor_name)
+                result = scholarly.search_author_id(instructors[instructor_name]['gscholar']['scholar_id'])
                 found = True
-                break
-            elif words_match2(instructor_name, result['name']):
-                logger.info("Possible match. Link: https://scholar.google.com/citations?user=%s", result['scholar_id'])
-                unsure_file.write(json.dumps({'instructor': instructor_name, 'result': result}) + "\n")
-                num_possible += 1
-
-    if found:
+            else:
+                logger.info("Searching instructor: %s", instructor_name)
+                # first page is fetched right away, next ones take tokens as results are iterated
+                results = rate_limited(scholarly.search_author(instructor_name), bucket, SEARCH_PAGE_SIZE)
+                found = False
+                for result in results:
+                    affiliation = result['affiliation'].lower()
+                    if ('columbia' in affiliation and 'british' not in affiliation) \
+                            or 'columbia' in result['email_domain'].lower() \
+                            or 'barnard' in result['email_domain'].lower():
+                        found = True
+                        break
+                    elif entity_resolver.is_match('gscholar', result['name'], instructor_name, result['scholar_id']):
+                        possible.append(result)
+
+            if found:
+                bucket.acquire()
+                scholarly.fill(result, sections=['indices', 'counts'])
+        except BLOCKED_ERRORS:
+            # next lookups go through the next proxy
+            blocks_in_row += 1
+            identities.rotate(identity)
+            raise
+        blocks_in_row = 0
+    return {'result': result if found else None, 'possible': possible}
+
+
+def _blocked_too_often() -> bool:
+    if blocks_in_row >= config.SCHOLAR_MAX_BLOCKS_IN_ROW:
+        logger.error("Stopping: %s lookups in a row were blocked", blocks_in_row)
+        return True
+    return False
+
+
+def on_lookup(instructor_name: str, lookup_result: dict):
+    """Stores lookup results, runs in the main thread"""
+    global num_processed, num_found, num_possible
+    for result in lookup_result['possible']:
+        logger.info("Possible match. Link: https://scholar.google.com/citations?user=%s", result['scholar_id'])
+        unsure_file.write(json.dumps({'instructor': instructor_name, 'result': result}) + "\n")
+        num_possible += 1
+
+    result = lookup_result['result']
+    if result is not None:
         num_found += 1
-        scholarly.fill(result, sections=['indices', 'counts'])
         logger.info("Found in GScholar: %s", result)
         gscholar = {
             'scholar_id': result.get('scholar_id'),
@@ -113,6 +173,7 @@ for instructor_name in names:
         # pictures[instructor_name] = result['url_picture']
         # exclude this one: https://scholar.google.com/citations?view_op=medium_photo&user=DTl7ej4AAAAJ
         instructors[instructor_name]['gscholar'] = gscholar
+        delta_log.append(instructor_name, {'gscholar': gscholar})
         instructors_internal_db.update_instructor(instructor_name, 'gscholar_last_update')
     else:
         logger.info("Instructor not found in Google Scholar: %s", instructor_name)
@@ -120,21 +181,28 @@ for instructor_name in names:
 
     # print progress
     num_processed += 1
-    logger.info("\n")
-    logger.info("Processed %s / %s", num_processed, MAX_PROCESS)
+    logger.info("Processed %s / %s", num_processed, will_process)
+    # checkpoints are cheap, so progress is saved after every instructor
+    _save()
     if num_processed % 10 == 0:
-        _save()
         logger.info("Updated instructors: %s / %s", num_found, MAX_PROCESS)
         logger.info("Unsure search results: %s", num_possible)
-        logger.info("*** Saved ***")
-    if num_processed == MAX_PROCESS:
-        break
 
-    # pause to avoid being banned
-    w = random.randint(MIN_WAIT, MAX_WAIT)
-    logger.info('Pausing for %s sec', w)
-    time.sleep(w)
+
+os.makedirs(config.DATA_GSCHOLAR_DIR, exist_ok=True)
+unsure_file = open(config.DATA_GSCHOLAR_UNSURE_FILENAME, 'a')  # list of possible matches
+
+names = list(instructors.keys())
+random.seed(0)
+random.shuffle(names)
+pictures = {}
+num_processed = 0
+num_found = 0
+num_possible = 0
+run_worker_pool(itertools.islice(filter(_due, names), MAX_PROCESS), lookup, config.SCHOLAR_WORKERS, on_lookup,
+                should_stop=_blocked_too_often)
 
 _save()
+_store()
 logger.info("Updated instructors: %s / %s", num_found, MAX_PROCESS)
 logger.info("Unsure search results (unsure.json): %s", num_possible)
@@ -7,12 +7,16 @@ import pandas as pd
 import models.cudata as cudata
 from columbia_crawler import util
 from cu_catalog import config
-from cu_catalog.models.util import str_similarity, extract_word_stems2dict
+from cu_catalog.models.entity_resolution import EntityResolver
+from cu_catalog.models.util import str_similarity, extract_word_stems2dict_many
 
 start_line = 516
 
-instructors_internal_db = util.InstructorsInternalDb(['gscholar_last_search', 'gscholar_last_update'])
+instructors_internal_db = util.open_instructors_internal_db(['gscholar_last_search', 'gscholar_last_update'])
 instructors = cudata.load_instructors()
+delta_log = cudata.InstructorsDeltaLog(config.DATA_GSCHOLAR_DELTA_LOG)
+delta_log.replay(instructors)
+entity_resolver = EntityResolver(config.DATA_ENTITY_RESOLUTION_DB, instructors.keys())
 classes = pd.concat([
     cudata.load_term('2016-Spring'),
     cudata.load_term('2016-Fall'),
@@ -36,9 +40,9 @@ def get_course_title_by_code(course_code: str):
 
 
 def _save():
-    df_json = pd.DataFrame(instructors.values())
-    cudata.store_instructors(df_json)
-    instructors_internal_db.store()
+    # changed instructors are already in delta log, stored in full at the end
+    delta_log.checkpoint()
+    instructors_internal_db.checkpoint()
     statf.flush()
 
 
@@ -69,8 +73,9 @@ while True:
     name_similarity = str_similarity(instructor_name, result['name'])
 
     # compute overlap of words in cu and cg descriptions
-    cu_words = extract_word_stems2dict(" ".join(catalog_instr['departments']) + " ".join(clss), remove_stopwords=True)
-    cg_words = extract_word_stems2dict(" ".join(result['interests']), remove_stopwords=True)
+    cu_words, cg_words = extract_word_stems2dict_many(
+        [" ".join(catalog_instr['departments']) + " ".join(clss), " ".join(result['interests'])],
+        remove_stopwords=True)
     overlap = set(w for w in cu_words.keys() if w in cg_words.keys())
 
     features = {'name': instructor_name,
@@ -115,6 +120,8 @@ while True:
             'cites_per_year': result.get('cites_per_year'),
         }
         catalog_instr['gscholar'] = gscholar
+        delta_log.append(instructor_name, {'gscholar': gscholar})
+        entity_resolver.set_decision('gscholar', result['name'], [instructor_name], result['scholar_id'])
         instructors_internal_db.update_instructor(instructor_name, 'gscholar_last_update')
         _save()
         features['label'] = True
@@ -129,4 +136,8 @@ while True:
     print("processed", num_line + 1)
 
 f.close()
+cudata.store_instructors(pd.DataFrame(instructors.values()))
+delta_log.clear()
+instructors_internal_db.store()
+instructors_internal_db.close()
 print("done.")
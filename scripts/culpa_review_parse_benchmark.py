@@ -0,0 +1,62 @@
+# Compares parsing of CULPA professor pages with many reviews:
+#   legacy  - the former parse_culpa_instructor loop: '//li/a' searched the whole page for every review
+#   scoped  - parse_culpa_review: selectors relative to the review card
+# Pages are generated with the same markup as culpa.info professor pages.
+#
+# Usage: ./run-script.sh scripts/culpa_review_parse_benchmark.py [reviews per page...]
+
+import sys
+import time
+
+from scrapy.http import HtmlResponse
+
+from columbia_crawler.spiders.culpa_search import parse_culpa_review
+
+REVIEW_HTML = '''
+<div class="card"><div class="card-body">
+  <ul><li><a href="/course/{i}">Course {i}</a></li></ul>
+  <p class="date">March 3, 2019</p>
+  <div class="review_content"><p>Review number {i}. Great lectures, fair exams.</p>
+    <p>Workload:</p><p>Weekly problem sets.</p></div>
+  <input class="agree" value="Agree {i}"><input class="disagree" value="Disagree 1">
+  <input class="funny" value="Funny 0">
+</div></div>
+'''
+
+
+def make_page(num_reviews: int) -> HtmlResponse:
+    body = '<html><body>' + ''.join(REVIEW_HTML.format(i=i) for i in range(num_reviews)) + '</body></html>'
+    return HtmlResponse('http://culpa.info/professors/1', body=body, encoding='utf-8')
+
+
+def legacy_course_codes(response):
+    result = []
+    for review_html in response.css('div.card div.card-body'):
+        course_codes = []
+        for meta in review_html.xpath('//li/a[contains(@href, "/course")]'):
+            course_codes.append({'t': meta.css('::text').get()})
+        result.append(course_codes)
+    return result
+
+
+def scoped(response):
+    return [parse_culpa_review(review_html) for review_html in response.css('div.card div.card-body')]
+
+
+def bench(name, func, response):
+    start = time.perf_counter()
+    result = func(response)
+    print("%-8s %8.3f sec" % (name, time.perf_counter() - start))
+    return result
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [50, 200, 800]
+    for num_reviews in sizes:
+        print("Reviews:", num_reviews)
+        response = make_page(num_reviews)
+        # legacy measures course links lookup only, the rest of the review parsing was the same
+        legacy = bench('legacy', legacy_course_codes, response)
+        reviews = bench('scoped', scoped, response)
+        print("Course links per review: legacy %s, scoped %s" % (len(legacy[0]), len(reviews[0]['course_codes'])))
+        print()
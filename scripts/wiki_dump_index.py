@@ -0,0 +1,24 @@
+# Builds local Wikipedia index used by wiki_search spider instead of the live API.
+# Download the abstracts dump first:
+#   wget https://dumps.wikimedia.org/enwiki/latest/enwiki-latest-abstract.xml.gz
+# then set WIKI_DUMP_INDEX in config.cfg to the index file.
+#
+# Usage: ./run-script.sh scripts/wiki_dump_index.py <abstracts dump> [index file]
+
+import logging
+import sys
+import time
+
+from columbia_crawler.wiki_dump import WikiDumpIndex
+from cu_catalog import config
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    dump_filename = sys.argv[1]
+    index_filename = sys.argv[2] if len(sys.argv) > 2 else config.WIKI_DUMP_INDEX
+    if not index_filename:
+        sys.exit("Index file not given and WIKI_DUMP_INDEX is not set")
+
+    start = time.perf_counter()
+    count = WikiDumpIndex(index_filename).build(dump_filename)
+    print("Indexed %s pages into %s in %.0f sec" % (count, index_filename, time.perf_counter() - start))
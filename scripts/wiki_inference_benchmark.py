@@ -0,0 +1,81 @@
+# Compares speed and memory of classifier inference paths on CPU:
+#   legacy  - the former predict_proba: model in train mode, autograd enabled, one row at a time
+#   single  - predict_proba: eval mode, inference mode, one row at a time
+#   batch   - predict_proba_batch: eval mode, inference mode, padded batches
+#
+# Usage: ./run-script.sh scripts/wiki_inference_benchmark.py [number of rows] [torch threads]
+
+import json
+import resource
+import sys
+import time
+
+import numpy as np
+import torch
+from scipy.special import softmax
+
+from cu_catalog import config
+from cu_catalog.models.wiki_search import WikiSearchClassifier
+
+
+def load_rows(limit: int):
+    rows = []
+    with open(config.DATA_WIKI_SEARCH_TRAIN_FILENAME, 'r') as f:
+        for line in f:
+            sample = json.loads(line)
+            for sr in sample['search_results']:
+                rows.append({'name': sample['name'],
+                             'department': sample['department'],
+                             'search_results.title': sr['title'],
+                             'search_results.snippet': sr['snippet']})
+                if len(rows) == limit:
+                    return rows
+    return rows
+
+
+def legacy_predict_proba(clf, rows):
+    clf.model.train()
+    predicted = []
+    for row in rows:
+        inputs = clf.tokenize(row, return_tensors='pt')
+        inputs = inputs.to(clf.model.device)
+        logits = clf.model(**inputs)
+        logits = logits.logits.cpu().detach().numpy()
+        proba = softmax(logits, axis=1)
+        predicted.append(proba[0])
+    clf.model.eval()
+    return np.array(predicted)
+
+
+def bench(name, func, rows):
+    start = time.perf_counter()
+    proba = func(rows)
+    secs = time.perf_counter() - start
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("%-8s %7.1f rows/sec  %6.2f sec  max RSS %6.0f MB" % (name, len(rows) / secs, secs, max_rss_mb))
+    return proba
+
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    if len(sys.argv) > 2:
+        torch.set_num_threads(int(sys.argv[2]))
+    print("Torch threads:", torch.get_num_threads())
+
+    clf = WikiSearchClassifier()
+    clf.load_model()
+    rows = load_rows(num_rows)
+    print("Rows:", len(rows))
+
+    # warm up
+    clf.predict_proba(rows[:5])
+
+    # new paths go first so max RSS shows their peak before the legacy path builds autograd graphs
+    proba_batch = bench('batch', clf.predict_proba_batch, rows)
+    proba_single = bench('single', clf.predict_proba, rows)
+    proba_legacy = bench('legacy', lambda r: legacy_predict_proba(clf, r), rows)
+
+    print()
+    print("Max abs diff single vs batch: %.5f" % np.abs(proba_single - proba_batch).max())
+    print("Labels agreement single vs legacy (dropout on in legacy): %.3f"
+          % (proba_single.argmax(-1) == proba_legacy.argmax(-1)).mean())
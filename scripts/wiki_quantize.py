@@ -0,0 +1,23 @@
+# Export INT8 dynamically quantized versions of the wiki classifiers and compare their accuracy
+# with full precision models on the test split. Enable quantized models with MODEL_QUANTIZED = True in config.
+
+from cu_catalog.models.wiki_article import WikiArticleClassifier
+from cu_catalog.models.wiki_search import WikiSearchClassifier
+
+if __name__ == '__main__':
+    for model_class in [WikiSearchClassifier, WikiArticleClassifier]:
+        print("=====", model_class.__name__, "=====")
+        model = model_class()
+        model.load_training_data()
+
+        print("\n*** Full precision model ***")
+        model.load_model(quantized=False)
+        model.evaluate()
+
+        model.export_quantized()
+        print("Exported:", model.quantized_model_filename)
+
+        print("\n*** Quantized INT8 model ***")
+        model.load_model(quantized=True)
+        model.evaluate()
+        print()
@@ -9,4 +9,5 @@ if __name__ == '__main__':
     model.load_training_data()
     model.fit()
     model.evaluate()
+    model.prefilter_report()
     model.persist_model()
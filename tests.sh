@@ -12,12 +12,21 @@ if [ $# -eq 0 ]; then
     scrapy check
     python3 -m doctest -v columbia_crawler/pipelines.py
     python3 -m doctest -v columbia_crawler/util.py
+    python3 -m doctest -v columbia_crawler/scheduler.py
+    python3 -m doctest -v columbia_crawler/wiki_dump.py
 
     python3 -m unittest columbia_crawler/spiders/test_catalog.py
+    python3 -m unittest columbia_crawler/spiders/test_wiki_search.py
     python3 -m unittest columbia_crawler/test_pipelines.py
+    python3 -m unittest columbia_crawler/test_util.py
+    python3 -m unittest columbia_crawler/test_inference.py
     popd
 
     # other tests
+    python3 -m doctest -v $DIR/cu_catalog/models/prediction_cache.py
+    python3 -m doctest -v $DIR/cu_catalog/models/entity_resolution.py
+    python3 -m doctest -v $DIR/cu_catalog/rate_limit.py
+    python3 -m doctest -v $DIR/cu_catalog/models/cudata.py
     # python3 -m doctest -v scripts/wiki_search_train.py
 else
     # run command with setup environment if arguments provided